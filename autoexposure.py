@@ -0,0 +1,61 @@
+import numpy as np
+
+RAW_LEVELS = 16384 # 14 bit ADC
+
+def searchLut(lut, T, side = 'left'):
+    # np.searchsorted() for temperatures in a LUT: LUTs start with NaN entries
+    # where the calibration math takes roots of negative values (e.g. with a
+    # low emissivity), those are searched as -inf to keep the LUT sorted
+    lut = np.fmax.accumulate(np.where(np.isnan(lut), -np.inf, lut))
+    return np.searchsorted(lut, T, side=side)
+
+class AutoExposure:
+    # Histogram based auto-exposure: percentile bounds of the raw frame are
+    # smoothed over time and the visualized range only follows them when they
+    # leave a hysteresis band, so single hot/cold pixels do not flip the range.
+    def __init__(self, low_percentile = 0.5, high_percentile = 99.5, smoothing = 0.2):
+        self.low_percentile = low_percentile
+        self.high_percentile = high_percentile
+        self.smoothing = smoothing
+        self.reset()
+
+    def reset(self):
+        self.T_low = None
+        self.T_high = None
+
+    def histogram(self, frame):
+        return np.bincount(frame.ravel(), minlength=RAW_LEVELS)
+
+    def percentiles(self, frame):
+        cdf = np.cumsum(self.histogram(frame))
+        total = cdf[-1]
+        raw_low  = int(np.searchsorted(cdf, total * self.low_percentile / 100., side='left'))
+        raw_high = int(np.searchsorted(cdf, total * self.high_percentile / 100., side='left'))
+        return raw_low, min(raw_high, RAW_LEVELS - 1)
+
+    def update(self, update, exposure, frame, lut):
+        raw_low, raw_high = self.percentiles(frame)
+        T_low, T_high = sorted((float(lut[raw_low]), float(lut[raw_high])))
+        if np.isnan(T_low) or np.isnan(T_high):
+            return update
+
+        if self.T_low is None:
+            self.T_low, self.T_high = T_low, T_high
+        else:
+            self.T_low  += self.smoothing * (T_low  - self.T_low)
+            self.T_high += self.smoothing * (T_high - self.T_high)
+
+        T_min, T_max, T_margin = exposure['T_min'], exposure['T_max'], exposure['T_margin']
+        if T_min                > self.T_low:  update, T_min = True, self.T_low - T_margin
+        if T_min + 2 * T_margin < self.T_low:  update, T_min = True, self.T_low - T_margin
+        if T_max                < self.T_high: update, T_max = True, self.T_high + T_margin
+        if T_max - 2 * T_margin > self.T_high: update, T_max = True, self.T_high + T_margin
+
+        exposure['T_min'] = T_min
+        exposure['T_max'] = T_max
+        return update
+
+    def rawRange(self, exposure, lut):
+        # the LUT is monotonic, so the visualized range maps back to raw values
+        raw_min, raw_max = (int(v) for v in searchLut(lut, (exposure['T_min'], exposure['T_max'])))
+        return raw_min, max(raw_max, raw_min + 1)
@@ -0,0 +1,119 @@
+import time
+import numpy as np
+
+class Baseline:
+    # Reference frame for change detection, kept in C: raw values shift with
+    # the fpa temperature and every calibration, so each frame is converted
+    # with its own LUT before it is averaged.
+    #   'fixed'     - set explicitly with set()
+    #   'rolling'   - mean of the last `length` frames passed to add()
+    #   'scheduled' - mean of the frames passed to add() per time-of-day slot
+    # Frames are raw frames with their LUT, or temperatures in C with lut=None.
+    # NaN temperatures are left out of the means, a pixel without any valid
+    # temperature has a NaN reference.
+    def __init__(self, mode = 'fixed', length = 16, slot_seconds = 3600):
+        if mode not in ('fixed', 'rolling', 'scheduled'):
+            raise ValueError('unknown baseline mode: ' + str(mode))
+        self.mode = mode
+        self.length = length
+        self.slot_seconds = slot_seconds
+        self.clear()
+
+    def clear(self):
+        self.frames = None  # ring buffer for rolling mode
+        self.count = 0
+        self.sum = None     # sum of the valid temperatures
+        self.valid = None   # number of valid temperatures per pixel
+        self.slots = {}     # slot -> [sum, valid, reference] for scheduled mode
+        self._reference = None
+
+    def slot(self, timestamp = None):
+        t = time.localtime(timestamp)
+        return (t.tm_hour * 3600 + t.tm_min * 60 + t.tm_sec) // self.slot_seconds
+
+    def _temperatures(self, frame, lut):
+        if lut is None:
+            return np.asarray(frame, dtype=np.float32)
+        return lut.astype(np.float32, copy=False)[frame]
+
+    def _split(self, T):
+        # NaN stored as 0 in the sums, with the mask of valid temperatures
+        valid = ~np.isnan(T)
+        return np.where(valid, T, 0), valid
+
+    def set(self, frame, lut = None, timestamp = None):
+        if self.mode == 'scheduled':
+            T, valid = self._split(self._temperatures(frame, lut))
+            self.slots[self.slot(timestamp)] = [T.astype(np.float64), valid.astype(np.int32), None]
+        else:
+            self.clear()
+            self.add(frame, lut)
+
+    def add(self, frame, lut = None, timestamp = None):
+        T = self._temperatures(frame, lut)
+        if self.mode == 'scheduled':
+            s = self.slots.setdefault(self.slot(timestamp), [np.zeros(T.shape, dtype=np.float64), np.zeros(T.shape, dtype=np.int32), None])
+            T, valid = self._split(T)
+            s[0] += T
+            s[1] += valid
+            s[2] = None
+            return
+
+        if self.frames is None or self.frames.shape[1:] != T.shape:
+            size = self.length if self.mode == 'rolling' else 1
+            self.frames = np.zeros((size,) + T.shape, dtype=np.float32)
+            self.sum = np.zeros(T.shape, dtype=np.float64)
+            self.valid = np.zeros(T.shape, dtype=np.int32)
+            self.count = 0
+        idx = self.count % len(self.frames)
+        if self.count >= len(self.frames):
+            old, valid = self._split(self.frames[idx])
+            self.sum -= old
+            self.valid -= valid
+        self.frames[idx] = T
+        T, valid = self._split(self.frames[idx])
+        self.sum += T
+        self.valid += valid
+        self.count += 1
+        self._reference = None
+
+    def ready(self, timestamp = None):
+        if self.mode == 'scheduled':
+            return self.slot(timestamp) in self.slots
+        return self.count > 0
+
+    def reference(self, timestamp = None):
+        # mean reference frame in C (float32), None if not available yet
+        if self.mode == 'scheduled':
+            s = self.slots.get(self.slot(timestamp))
+            if s is None: return None
+            if s[2] is None:
+                s[2] = self._mean(s[0], s[1])
+            return s[2]
+        if self.count == 0:
+            return None
+        if self._reference is None:
+            self._reference = self._mean(self.sum, self.valid)
+        return self._reference
+
+    def _mean(self, total, valid):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return (total / valid).astype(np.float32)
+
+    def diff(self, frame, lut = None, timestamp = None):
+        # float32 difference to the reference in C
+        ref = self.reference(timestamp)
+        if ref is None:
+            return None
+        return self._temperatures(frame, lut) - ref
+
+    def changes(self, diff, threshold, min_area = 1):
+        # mask of changed pixels and bounding boxes ((x,y),(w,h)) of changed regions
+        import cv2
+        mask = (np.abs(diff) > threshold).view(np.uint8)
+        n, labels, stats, centroids = cv2.connectedComponentsWithStats(mask, connectivity=8)
+        boxes = []
+        for x, y, w, h, area in stats[1:]:
+            if area >= min_area:
+                boxes.append(((int(x), int(y)), (int(w), int(h))))
+        return mask.view(bool), boxes
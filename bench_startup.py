@@ -0,0 +1,57 @@
+#!/usr/bin/python3
+# Startup time benchmark: the headless modules must not pull in OpenCV or
+# matplotlib at import time. Exits with 1 on a regression.
+import os
+import subprocess
+import sys
+from argparse import ArgumentParser
+
+HEADLESS_MODULES = ['ht301_hacklib', 'utils', 'autoexposure', 'baseline', 'hotspots', 'recording', 'emissivity', 'scheduler', 'regions', 'colormaps', 'pyplot']
+HEAVY_MODULES = ['cv2', 'matplotlib']
+
+PROBE = '''
+import sys, time
+t = time.perf_counter()
+import {module}
+t = time.perf_counter() - t
+print(t, ' '.join(m for m in {heavy!r} if m in sys.modules))
+'''
+
+def importTime(module, repeat):
+    best, heavy = None, ''
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, '-c', PROBE.format(module=module, heavy=HEAVY_MODULES)],
+                             cwd=os.path.dirname(os.path.abspath(__file__)),
+                             capture_output=True, text=True, check=True).stdout.split(maxsplit=1)
+        t = float(out[0])
+        best = t if best is None else min(best, t)
+        heavy = out[1].strip() if len(out) > 1 else ''
+    return best, heavy
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("-n", "--repeat",
+        dest="repeat", default=5, type=int,
+        help="number of runs per module, the fastest one is reported (default: 5)"
+    )
+    parser.add_argument("--max-ms",
+        dest="max_ms", default=300., type=float,
+        help="maximum allowed import time per module in ms (default: 300)"
+    )
+    args = parser.parse_args()
+
+    failed = False
+    for module in HEADLESS_MODULES:
+        t, heavy = importTime(module, args.repeat)
+        status = 'ok'
+        if heavy:
+            status, failed = 'FAIL: imports ' + heavy, True
+        elif t * 1000 > args.max_ms:
+            status, failed = 'FAIL: too slow', True
+        print('%-16s %8.1f ms  %s' % (module, t * 1000, status))
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
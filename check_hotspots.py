@@ -0,0 +1,65 @@
+#!/usr/bin/python3
+# Hotspot tracker check on synthetic frames: a blob moving at constant speed
+# has to keep its track id, sub-pixel position and velocity, also across
+# frames it is missing in. Exits with 1 on a failure.
+import sys
+from argparse import ArgumentParser
+import numpy as np
+
+from hotspots import HotspotTracker
+
+HEIGHT, WIDTH = 288, 384
+LUT = np.arange(16384, dtype=np.float64) / 100. - 40. # raw -> C, 0.01 C per raw value
+
+def frame(blobs):
+    # background at 20 C with gaussian blobs (x, y, peak C)
+    y, x = np.mgrid[:HEIGHT, :WIDTH]
+    f = np.full((HEIGHT, WIDTH), 20.)
+    for bx, by, T in blobs:
+        f += (T - 20.) * np.exp(-((x - bx)**2 + (y - by)**2) / (2 * 2.**2))
+    return np.rint((f + 40.) * 100.).astype(np.uint16)
+
+def check(name, ok, detail):
+    print('%-32s %s  %s' % (name, 'ok' if ok else 'FAIL', detail))
+    return ok
+
+def main():
+    parser = ArgumentParser(description="check the hotspot tracker on synthetic frames")
+    parser.add_argument("--fps",
+        dest="fps", default=25., type=float,
+        help="frame rate of the synthetic sequence (default: 25)"
+    )
+    parser.add_argument("--speed",
+        dest="speed", default=20., type=float,
+        help="speed of the blob in pixel/s (default: 20)"
+    )
+    parser.add_argument("--missed",
+        dest="missed", default=3, type=int,
+        help="number of frames the blob disappears for (default: 3)"
+    )
+    args = parser.parse_args()
+
+    tracker = HotspotTracker(threshold=40., max_missed=args.missed + 2, velocity_smoothing=1.)
+    ok, ids = True, set()
+    x0, y0 = 50.27, 100.61
+    for i in range(40):
+        t = i / args.fps
+        x = x0 + args.speed * t
+        hidden = 20 <= i < 20 + args.missed
+        tracks = tracker.update(frame([] if hidden else [(x, y0, 80.)]), LUT, t)
+        if hidden:
+            continue
+        ids.update(int(track['id']) for track in tracks)
+        track = tracks[0]
+        if i in (19, 20 + args.missed, 39):
+            ok &= check('frame %d position' % i, abs(track['x'] - x) < 0.1 and abs(track['y'] - y0) < 0.1,
+                        'x %.2f (%.2f) y %.2f (%.2f)' % (track['x'], x, track['y'], y0))
+            ok &= check('frame %d velocity' % i, abs(track['vx'] - args.speed) < 0.05 * args.speed and abs(track['vy']) < 0.05 * args.speed,
+                        'vx %.2f vy %.2f pixel/s' % (track['vx'], track['vy']))
+    ok &= check('single track id', ids == {0}, 'ids %s' % sorted(ids))
+
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
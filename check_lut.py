@@ -0,0 +1,186 @@
+#!/usr/bin/python3
+# LUT regression check: replays the meta blocks of recordings (saved with 'r'
+# in opencv.py) or of synthetic calibration states in low and high range
+# through the batch LUT code and compares LUTs and info() temperatures with a
+# golden file made with --update from the scalar temperatureLut().
+# Exits with 1 on a regression.
+import os
+import sys
+import time
+from argparse import ArgumentParser
+import numpy as np
+
+import ht301_hacklib
+import recording
+
+# host side parameters replayed in addition to the device ones
+HOST_PARAMETERS = {'Emiss': 0.5, 'refltmp': 30., 'airtmp': 10., 'Humi': 0.8, 'Distance': 5}
+
+# name -> (high range, parameters)
+CASES = {
+    'low':       (False, None),
+    'high':      (True,  None),
+    'low_host':  (False, HOST_PARAMETERS),
+    'high_host': (True,  HOST_PARAMETERS),
+}
+
+INFO_KEYS = ('Tmin_C', 'Tmax_C', 'Tcenter_C')
+
+def calibrationStates(filenames, max_states):
+    # meta blocks of the distinct calibration states in the recordings
+    metas, seen = [], set()
+    for filename in filenames:
+        for frame_raw in recording.load(filename):
+            meta = frame_raw[-4:]
+            key = ht301_hacklib.calibrationFingerprint(meta)
+            if key in seen: continue
+            seen.add(key)
+            metas.append(np.array(meta))
+            if len(metas) >= max_states:
+                return np.array(metas)
+    return np.array(metas, dtype='<u2').reshape((-1, 4, recording.FRAME_RAW_SHAPE[1]))
+
+def syntheticStates(count, seed = 0):
+    # meta blocks with random calibration states and parameters in the ranges
+    # seen on devices, and states for the edge cases of the LUT math: no
+    # emissivity, no calibration (arange fallback), low emissivity (NaN at the
+    # low raw end) and distances above 20 m
+    rng = np.random.default_rng(seed)
+    metas = np.zeros((count, 4, recording.FRAME_RAW_SHAPE[1]), dtype='<u2')
+    for i, meta in enumerate(metas):
+        m3 = meta[3].view(np.uint8)
+        meta[3, 0] = rng.integers(3000, 9000)                                                   # cx
+        meta[3, 1] = round((rng.uniform(10, 50) - ht301_hacklib.ABSOLUTE_ZERO_CELSIUS) * 10)   # core temperature
+        meta[0, 1] = round(7800 - (rng.uniform(10, 50) - 20) * 36)                              # fpa temperature
+        coeffs = [rng.uniform(0.5, 2), rng.uniform(50, 150), rng.uniform(-1e-4, 1e-4), rng.uniform(-1e-2, 1e-2), rng.uniform(1, 4)]
+        # Fix, refltmp, airtmp, Humi, Emiss
+        parameters = [0., rng.uniform(0, 40), rng.uniform(0, 40), rng.uniform(0.1, 0.9), rng.uniform(0.5, 1)]
+        distance = rng.integers(0, 20)
+        edge = i % 8
+        if edge == 1: parameters[4] = 0.
+        if edge == 2: coeffs[0] = 0.
+        if edge == 3: parameters[4] = rng.uniform(0.01, 0.1)
+        if edge == 4: distance = rng.integers(20, 100)
+        m3[6:26].view(np.float32)[:] = coeffs
+        m3[254:274].view(np.float32)[:] = parameters
+        m3[274:276].view(np.uint16)[:] = distance
+        m3[48:58] = np.frombuffer(b'T3-317-13\0', dtype=np.uint8)
+        # raw values of the min / max / center point
+        meta[0, 7], meta[0, 12], meta[0, 4] = np.sort(rng.integers(0, 16384, 3))
+    return metas
+
+def scalarLuts(metas, high_range, parameters):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.array([ht301_hacklib.temperatureLut(ht301_hacklib.fpaTemperature(m[0]), m[3], high_range, parameters) for m in metas]).reshape(-1, 16384)
+
+def batchLuts(metas, high_range, parameters):
+    return ht301_hacklib.temperatureLuts(metas, high_range, parameters)
+
+def infoValues(metas, luts, high_range, parameters):
+    values = np.empty((len(metas), len(INFO_KEYS)))
+    for i, meta in enumerate(metas):
+        info, _ = ht301_hacklib.info(meta, ht301_hacklib.device_info(meta), ht301_hacklib.HT301.FRAME_WIDTH,
+                                     ht301_hacklib.HT301.FRAME_HEIGHT, high_range, parameters, luts[i])
+        values[i] = [info[k] for k in INFO_KEYS]
+    return values
+
+def replay(metas, raw_index, luts_function):
+    # sampled LUTs and info() values of all cases, with the rate of luts_function
+    result = {}
+    for name, (high_range, parameters) in CASES.items():
+        t = time.perf_counter()
+        luts = luts_function(metas, high_range, parameters)
+        t = time.perf_counter() - t
+        result[name + '_lut'] = luts[:, raw_index]
+        result[name + '_info'] = infoValues(metas, luts, high_range, parameters)
+        print('%-10s %6d states  %8.0f states/s %s' % (name, len(metas), len(metas) / max(t, 1e-9), luts_function.__name__))
+    return result
+
+def compare(name, actual, expected, atol):
+    nan = np.isnan(actual), np.isnan(expected)
+    valid = ~nan[0] & ~nan[1]
+    error = float(np.abs(actual - expected)[valid].max()) if valid.any() else 0.
+    status = 'ok'
+    if not np.array_equal(*nan): status = 'FAIL: NaN mismatch'
+    elif error > atol:           status = 'FAIL: above %g' % atol
+    print('%-24s max error %10.3g C  %s' % (name, error, status))
+    return status == 'ok'
+
+def main():
+    parser = ArgumentParser(description="compare the temperature LUT math with golden values from recordings")
+    parser.add_argument("recordings", nargs='*',
+        help="recordings to take the calibration states from (with --update)"
+    )
+    parser.add_argument("--synthetic",
+        dest="synthetic", default=0, type=int, metavar='N',
+        help="add N synthetic calibration states (with --update)"
+    )
+    parser.add_argument("-g", "--golden",
+        dest="golden", default="lut_golden.npz",
+        help="golden file (default: lut_golden.npz)"
+    )
+    parser.add_argument("--update",
+        action="store_true", dest="update", default=False,
+        help="write the golden file from the recordings instead of checking"
+    )
+    parser.add_argument("--max-states",
+        dest="max_states", default=2000, type=int,
+        help="maximum number of calibration states taken from the recordings (default: 2000)"
+    )
+    parser.add_argument("--samples",
+        dest="samples", default=256, type=int,
+        help="number of raw values per LUT stored in the golden file (default: 256)"
+    )
+    parser.add_argument("--atol",
+        dest="atol", default=1e-4, type=float,
+        help="allowed deviation from the golden values in °C (default: 1e-4)"
+    )
+    parser.add_argument("--scalar",
+        dest="scalar", default=20, type=int,
+        help="number of states also checked with the scalar temperatureLut() (default: 20)"
+    )
+    parser.add_argument("--scalar-atol",
+        dest="scalar_atol", default=1e-9, type=float,
+        help="allowed deviation of the batch from the scalar LUTs in °C (default: 1e-9)"
+    )
+    args = parser.parse_args()
+
+    if args.update:
+        if not args.recordings and not args.synthetic:
+            parser.error('--update needs recordings or --synthetic')
+        metas = calibrationStates(args.recordings, args.max_states)
+        metas = np.concatenate((metas, syntheticStates(args.synthetic)))
+        if len(metas) == 0:
+            parser.error('no frames in recordings')
+        raw_index = np.unique(np.linspace(0, 16383, args.samples).round().astype(np.intp))
+        # golden values from the scalar code, the batch code is what gets checked
+        golden = replay(metas, raw_index, scalarLuts)
+        np.savez_compressed(args.golden, meta=metas, raw_index=raw_index, **golden)
+        print('wrote', len(metas), 'calibration states to:', args.golden)
+        return
+
+    if not os.path.exists(args.golden):
+        parser.error('golden file %s not found, create it with: check_lut.py --update RECORDING...' % args.golden)
+    golden = np.load(args.golden)
+    metas, raw_index = golden['meta'], golden['raw_index']
+    result = replay(metas, raw_index, batchLuts)
+
+    ok = True
+    for name in sorted(result):
+        ok &= compare(name, result[name], golden[name], args.atol)
+
+    # batch and scalar LUT code have to agree
+    count = min(args.scalar, len(metas))
+    for name, (high_range, parameters) in CASES.items() if count else ():
+        batch = batchLuts(metas[:count], high_range, parameters)
+        t = time.perf_counter()
+        scalar = scalarLuts(metas[:count], high_range, parameters)
+        t = time.perf_counter() - t
+        print('%-10s %6d states  %8.0f states/s scalarLuts' % (name, count, count / max(t, 1e-9)))
+        ok &= compare(name + ' batch/scalar', batch, scalar, args.scalar_atol)
+
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
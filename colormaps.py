@@ -0,0 +1,82 @@
+import numpy as np
+from autoexposure import RAW_LEVELS, searchLut
+
+# colormaps offered by both viewers: OpenCV ones and the custom palettes below,
+# any other OpenCV colormap name works as well
+COLORMAPS = ['inferno', 'jet', 'cividis', 'viridis', 'magma', 'plasma', 'turbo', 'hot', 'bone', 'rainbow', 'ironbow', 'white_hot', 'black_hot']
+
+# custom palettes: evenly spaced RGB anchors, interpolated to 256 colors
+PALETTES = {
+    'ironbow':   [(0, 0, 0), (32, 0, 140), (204, 0, 119), (255, 165, 0), (255, 215, 0), (255, 255, 255)],
+    'white_hot': [(0, 0, 0), (255, 255, 255)],
+    'black_hot': [(255, 255, 255), (0, 0, 0)],
+}
+
+# color used for the isotherm band
+ISOTHERM_COLOR = (0, 255, 0)
+
+MAX_TABLES = 64
+
+_palettes = {}
+_tables = {}
+
+def palette(name):
+    # 256 x RGB uint8 colors of a colormap, ValueError for unknown names
+    p = _palettes.get(name)
+    if p is None:
+        if name in PALETTES:
+            anchors = np.array(PALETTES[name], dtype=np.float64)
+            x = np.linspace(0, 255, len(anchors))
+            p = np.stack([np.interp(np.arange(256), x, anchors[:,c]) for c in range(3)], axis=1).round().astype(np.uint8)
+        else:
+            import cv2
+            code = getattr(cv2, 'COLORMAP_' + name.upper(), None)
+            if code is None:
+                raise ValueError('unknown colormap: ' + name)
+            p = cv2.applyColorMap(np.arange(256, dtype=np.uint8), code).reshape(256, 3)[:, ::-1].copy()
+        p.flags.writeable = False
+        _palettes[name] = p
+    return p
+
+def registerColormap(name, colors):
+    # add / replace a custom palette given as RGB anchors
+    PALETTES[name] = list(colors)
+    _palettes.pop(name, None)
+    for key in [k for k in _tables if k[0] == name]:
+        del _tables[key]
+    if name not in COLORMAPS:
+        COLORMAPS.append(name)
+
+def colorTable(name, raw_min, raw_max, rgb = False, isotherm = None):
+    # RAW_LEVELS x 4 uint8 table (BGRA, or RGBA with rgb) of the colors of all
+    # raw values for the visualized raw range, cached per (colormap, range),
+    # isotherm: (raw_low, raw_high) painted with ISOTHERM_COLOR
+    key = (name, raw_min, raw_max, rgb, isotherm)
+    table = _tables.get(key)
+    if table is None:
+        if len(_tables) >= MAX_TABLES: _tables.clear()
+        index = np.arange(RAW_LEVELS, dtype=np.float32)
+        index -= raw_min
+        index /= max(raw_max - raw_min, 1)
+        index = (np.clip(index, 0, 1) * 255).astype(np.uint8)
+        p = palette(name)
+        table = np.full((RAW_LEVELS, 4), 255, dtype=np.uint8)
+        table[:, :3] = p[index] if rgb else p[index, ::-1]
+        if isotherm is not None:
+            low, high = isotherm
+            table[max(low, 0):max(high + 1, 0), :3] = ISOTHERM_COLOR if rgb else ISOTHERM_COLOR[::-1]
+        table.flags.writeable = False
+        _tables[key] = table
+    return table
+
+def isothermRange(lut, T_low, T_high):
+    # raw values with temperatures in [T_low, T_high]
+    return int(searchLut(lut, T_low, side='left')), int(searchLut(lut, T_high, side='right')) - 1
+
+def colorize(frame, table, out = None):
+    # one gather of 32 bit colors per pixel, (h, w, 4) uint8 image,
+    # mode='clip' as take() buffers out with the default mode
+    if out is None:
+        out = np.empty(frame.shape + (4,), dtype=np.uint8)
+    table.view(np.uint32).reshape(-1).take(frame, out=out.view(np.uint32).reshape(frame.shape), mode='clip')
+    return out
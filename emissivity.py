@@ -0,0 +1,106 @@
+import numpy as np
+import ht301_hacklib
+import utils
+
+class EmissivityCorrection:
+    # Radiometric correction with emissivity / reflected temperature set per
+    # region or per pixel instead of the single values stored in the device.
+    # Regions are kept as a label image, so the correction is one gather in a
+    # (regions x 16384) LUT; per pixel maps are applied in float32 with the
+    # radiometric terms precomputed. Both are cached until the regions/maps or
+    # the calibration fingerprint of the frame change.
+    def __init__(self, shape = (ht301_hacklib.HT301.FRAME_HEIGHT, ht301_hacklib.HT301.FRAME_WIDTH)):
+        self.shape = shape
+        self.version = 0
+        self.clear()
+
+    def clear(self):
+        self.labels = np.zeros(self.shape, dtype=np.uint8)
+        self.regions = [(None, None)] # label -> (emissivity, reflected temperature), None: device value
+        self.emissivity_map = None
+        self.reflected_map = None
+        self._changed()
+
+    def _changed(self):
+        self.version += 1
+        self._lut_key = None
+        self._terms_key = None
+
+    def addRegion(self, roi, emissivity = None, reflected = None):
+        if len(self.regions) > 255:
+            raise ValueError('too many regions')
+        ((x1,y1),(x2,y2)) = utils.correctRoi(roi, self.shape)
+        label = len(self.regions)
+        self.labels[y1:y2, x1:x2] = label
+        self.regions.append((emissivity, reflected))
+        self._changed()
+        return label
+
+    def setMaps(self, emissivity = None, reflected = None):
+        # per pixel values, NaN pixels fall back to the region / device value
+        self.emissivity_map = None if emissivity is None else np.broadcast_to(np.asarray(emissivity, dtype=np.float32), self.shape)
+        self.reflected_map = None if reflected is None else np.broadcast_to(np.asarray(reflected, dtype=np.float32), self.shape)
+        self._changed()
+
+    def _regionValues(self, p):
+        emiss = np.array([p['Emiss'] if e is None else e for e, _ in self.regions])
+        refl = np.array([p['refltmp'] if r is None else r for _, r in self.regions])
+        return emiss, refl
+
+    def _prepare(self, meta, high_range, parameters):
+        p = ht301_hacklib.readParameters(meta[3])
+        if parameters: p.update(parameters)
+        fingerprint = ht301_hacklib.calibrationFingerprint(meta, high_range, parameters)
+        lut_key = (fingerprint, self.version)
+        if lut_key == self._lut_key:
+            return
+        self._lut_key = lut_key
+
+        # same fallback to raw values as temperatureLut() for invalid calibration / emissivity
+        identity = np.arange(16384.0)
+        if abs(p['coeffs'][0]) < 0.0001:
+            self._lut2d = np.tile(identity.astype(np.float32), (len(self.regions), 1))
+            self._fallback = True
+            return
+        self._fallback = False
+
+        t = ht301_hacklib.atmosphereTransmittance(p['airtmp'], p['Humi'], p['Distance'])
+        self._distance_c = ht301_hacklib.distanceCorrection(p['Distance'])
+        self._airtmp = p['airtmp']
+        Ttot = ht301_hacklib.totalTemperatureLut(ht301_hacklib.fpaTemperature(meta[0]), p['coretmp'], p['cx'], p['coeffs'], high_range)
+        emiss, refl = self._regionValues(p)
+
+        if self.emissivity_map is None and self.reflected_map is None:
+            with np.errstate(divide='ignore', invalid='ignore'):
+                terms = ht301_hacklib.radiometricTerms(emiss[:,None], refl[:,None], p['airtmp'], t)
+                lut2d = ht301_hacklib.objectTemperature(Ttot[None,:], *terms, p['airtmp'], self._distance_c)
+            lut2d[np.abs(emiss) < 0.0001] = identity
+            self._lut2d = lut2d.astype(np.float32)
+            return
+
+        self._Ttot = Ttot.astype(np.float32)
+        # the per pixel terms only depend on the parameter block, not on the fpa temperature
+        terms_key = (fingerprint[2], self.version)
+        if terms_key != self._terms_key:
+            self._terms_key = terms_key
+            emiss, refl = emiss.astype(np.float32)[self.labels], refl.astype(np.float32)[self.labels]
+            if self.emissivity_map is not None:
+                emiss = np.where(np.isnan(self.emissivity_map), emiss, self.emissivity_map)
+            if self.reflected_map is not None:
+                refl = np.where(np.isnan(self.reflected_map), refl, self.reflected_map)
+            self._invalid = np.abs(emiss) < 0.0001
+            if not self._invalid.any(): self._invalid = None
+            with np.errstate(divide='ignore', invalid='ignore'):
+                self._terms = ht301_hacklib.radiometricTerms(emiss, refl, np.float32(p['airtmp']), np.float32(t))
+
+    def apply(self, frame, meta, high_range = False, parameters = None):
+        # temperature in C (float32) of every pixel of a raw frame,
+        # parameters: host side values as in HT301.setParameters()
+        self._prepare(meta, high_range, parameters)
+        if self._fallback or (self.emissivity_map is None and self.reflected_map is None):
+            return self._lut2d[self.labels, frame]
+        with np.errstate(invalid='ignore'):
+            T = ht301_hacklib.objectTemperature(self._Ttot[frame], *self._terms, self._airtmp, self._distance_c)
+        if self._invalid is not None:
+            T[self._invalid] = frame[self._invalid]
+        return T
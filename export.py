@@ -0,0 +1,156 @@
+#!/usr/bin/python3
+import os
+from argparse import ArgumentParser
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import cv2
+import numpy as np
+
+import ht301_hacklib
+import recording
+from opencv import FrameProcessor, addDisplayArguments, addParameterArguments, getParameters, getRegion
+
+VIDEO_CODECS = {'.mp4': 'mp4v', '.avi': 'MJPG'}
+
+# memory for rendered frames waiting to be written to a video
+MAX_MEMORY_MB = 1024
+
+
+def highRange(args, flags, i):
+    # sensor mode stored with the recording, -m for recordings without it
+    if args.sensor is not None or flags is None:
+        return args.sensor == 'high'
+    return bool(flags[i] & recording.FLAG_HIGH_RANGE)
+
+
+def settling(flags, i):
+    # frames recorded while the sensor settled, left out of the auto exposure
+    return flags is not None and bool(flags[i] & recording.FLAG_SETTLING)
+
+
+def createProcessor(args):
+    return FrameProcessor(ht301_hacklib.HT301.FRAME_WIDTH, ht301_hacklib.HT301.FRAME_HEIGHT, args.scale, args.colormap, args.range, getRegion(args), args.isotherm)
+
+
+def exposurePass(args, frames, flags):
+    # (T_min, T_max) of every frame: the auto exposure depends on all frames
+    # before, so it runs once over the whole recording and the chunks only
+    # render, the output is the same for any -j / --chunk
+    processor = createProcessor(args)
+    parameters = getParameters(args)
+    exposures = np.empty((len(frames), 2))
+    key = lut = None
+    for i, frame_raw in enumerate(frames):
+        if not settling(flags, i):
+            # the LUT only changes with the calibration state
+            meta, high_range = frame_raw[-4:], highRange(args, flags, i)
+            fingerprint = ht301_hacklib.calibrationFingerprint(meta, high_range, parameters)
+            if fingerprint != key:
+                key, lut = fingerprint, ht301_hacklib.temperatureLut(ht301_hacklib.fpaTemperature(meta[0]), meta[3], high_range, parameters)
+            processor.updateExposure(frame_raw[:-4], lut)
+        exposures[i] = processor.exposure['T_min'], processor.exposure['T_max']
+    return exposures
+
+
+def renderChunk(job):
+    args, start, end, exposures = job
+    frames = recording.load(args.input)
+    flags = recording.loadFlags(args.input, len(frames))
+    processor = createProcessor(args)
+    parameters = getParameters(args)
+
+    images = []
+    for i in range(start, end):
+        frame, info, lut = recording.frameInfo(frames[i], highRange(args, flags, i), parameters)
+        exposure = exposures[i - start] if exposures is not None else None
+        image = processor.render(frame, info, lut, args.legend, args.markers, exposure=exposure)
+        if isVideo(args.output):
+            images.append(image)
+        else:
+            cv2.imwrite(os.path.join(args.output, '%06d.png' % i), image)
+    return images
+
+
+def isVideo(filename):
+    return os.path.splitext(filename)[1].lower() in VIDEO_CODECS
+
+
+def main():
+    parser = ArgumentParser(description="render a recording (saved with 'r' in opencv.py) to a video or png images")
+    parser.add_argument("input",
+        help="recording to render"
+    )
+    parser.add_argument("output",
+        help="output video (.mp4, .avi) or directory for numbered png images"
+    )
+    parser.add_argument("-m", "--sensor-mode",
+        dest="sensor",  choices=['low','high'], default=None,
+        help="sensor mode the recording was captured with (default: as recorded, low for recordings without .flags file)"
+    )
+    addDisplayArguments(parser)
+    addParameterArguments(parser)
+    parser.add_argument("-f", "--fps",
+        dest="fps", default=25., type=float,
+        help="frame rate of the output video (default: 25)"
+    )
+    parser.add_argument("-j", "--jobs",
+        dest="jobs", default=os.cpu_count(), type=int,
+        help="number of rendering processes (default: number of cpus)"
+    )
+    parser.add_argument("--chunk",
+        dest="chunk", default=50, type=int,
+        help="maximum number of frames rendered per job (default: 50)"
+    )
+    parser.add_argument("--max-memory",
+        dest="max_memory", default=MAX_MEMORY_MB, type=int, metavar='MB',
+        help="memory for rendered frames waiting to be written to a video (default: %d)" % MAX_MEMORY_MB
+    )
+    args = parser.parse_args()
+
+    frames = recording.load(args.input)
+    count = len(frames)
+    if count == 0:
+        parser.error('no frames in recording: ' + args.input)
+    exposures = None if args.range else exposurePass(args, frames, recording.loadFlags(args.input, count))
+
+    # one chunk per process in flight and one being written
+    in_flight = args.jobs + 1
+    writer = None
+    if isVideo(args.output):
+        processor = createProcessor(args)
+        size = (processor.getWidth(args.legend), processor.getHeight())
+        frame_bytes = size[0] * size[1] * 3
+        args.chunk = max(1, min(args.chunk, args.max_memory * 2**20 // (frame_bytes * in_flight)))
+        fourcc = cv2.VideoWriter_fourcc(*VIDEO_CODECS[os.path.splitext(args.output)[1].lower()])
+        writer = cv2.VideoWriter(args.output, fourcc, args.fps, size)
+        if not writer.isOpened():
+            raise Exception("can't open video writer for: " + args.output)
+    else:
+        os.makedirs(args.output, exist_ok=True)
+    jobs = [(args, start, min(start + args.chunk, count), exposures[start:start + args.chunk] if exposures is not None else None)
+            for start in range(0, count, args.chunk)]
+
+    try:
+        with ProcessPoolExecutor(args.jobs) as executor:
+            # limit the chunks in flight, finished chunks are written in order
+            pending = deque()
+            jobs = iter(jobs)
+            done = 0
+            while True:
+                while len(pending) < in_flight:
+                    job = next(jobs, None)
+                    if job is None: break
+                    pending.append(executor.submit(renderChunk, job))
+                if not pending: break
+                for image in pending.popleft().result():
+                    writer.write(image)
+                done = min(done + args.chunk, count)
+                print('rendered %d/%d frames' % (done, count), end='\r')
+        print()
+    finally:
+        if writer:
+            writer.release()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+import time
+import numpy as np
+from autoexposure import searchLut
+
+TRACK_DTYPE = np.dtype([
+    ('id', np.int32),       # -1 for a free slot
+    ('x', np.float32),      # sub-pixel position
+    ('y', np.float32),
+    ('vx', np.float32),     # velocity in pixel/s
+    ('vy', np.float32),
+    ('T', np.float32),      # last temperature in C
+    ('raw', np.uint16),     # last raw value
+    ('hits', np.int32),     # number of frames the track was detected in
+    ('missed', np.int32),   # consecutive frames without detection
+    ('last_seen', np.float64),
+])
+
+def detectHotspots(frame, lut, threshold, radius = 3, max_count = 32):
+    # local maxima of the raw frame above threshold (C), refined to sub-pixel position
+    import cv2
+    raw_threshold = int(searchLut(lut, threshold))
+    kernel = np.ones((2 * radius + 1, 2 * radius + 1), dtype=np.uint8)
+    peaks = (frame == cv2.dilate(frame, kernel)) & (frame >= raw_threshold)
+
+    # plateaus of equal values form one component, its centroid is the position
+    n, labels, stats, centroids = cv2.connectedComponentsWithStats(peaks.view(np.uint8), connectivity=8)
+    if n <= 1:
+        return np.zeros((0, 2), dtype=np.float32), np.zeros(0, dtype=np.uint16)
+
+    pos = centroids[1:].astype(np.float32)
+    xi = np.clip(np.rint(pos[:,0]).astype(np.intp), 0, frame.shape[1] - 1)
+    yi = np.clip(np.rint(pos[:,1]).astype(np.intp), 0, frame.shape[0] - 1)
+    raw = frame[yi, xi]
+
+    order = np.argsort(raw)[::-1][:max_count]
+    pos, xi, yi, raw = pos[order], xi[order], yi[order], raw[order]
+    single = stats[1:, cv2.CC_STAT_AREA][order] == 1
+
+    # parabola through the 3 neighbours in x and y for single pixel maxima
+    inner = single & (xi > 0) & (xi < frame.shape[1] - 1) & (yi > 0) & (yi < frame.shape[0] - 1)
+    if inner.any():
+        x, y = xi[inner], yi[inner]
+        c = frame[y, x].astype(np.float32)
+        for axis, (a, b) in enumerate(((frame[y, x-1], frame[y, x+1]), (frame[y-1, x], frame[y+1, x]))):
+            a, b = a.astype(np.float32), b.astype(np.float32)
+            denom = a - 2 * c + b
+            with np.errstate(divide='ignore', invalid='ignore'):
+                offset = np.where(denom < 0, 0.5 * (a - b) / denom, 0.)
+            pos[inner, axis] += np.clip(offset, -0.5, 0.5)
+
+    return pos, raw
+
+
+class HotspotTracker:
+    def __init__(self, threshold, max_tracks = 32, history = 256, max_distance = 10., max_missed = 5, radius = 3, velocity_smoothing = 0.5):
+        self.threshold = threshold
+        self.max_distance = max_distance
+        self.max_missed = max_missed
+        self.radius = radius
+        self.velocity_smoothing = velocity_smoothing
+        self.table = np.zeros(max_tracks, dtype=TRACK_DTYPE)
+        self.table['id'] = -1
+        self.history_T = np.full((max_tracks, history), np.nan, dtype=np.float32)
+        self.history_t = np.zeros((max_tracks, history), dtype=np.float64)
+        self.next_id = 0
+
+    def update(self, frame, lut, timestamp = None):
+        if timestamp is None: timestamp = time.monotonic()
+
+        det_pos, det_raw = detectHotspots(frame, lut, self.threshold, self.radius, len(self.table))
+        det_T = lut[det_raw].astype(np.float32)
+
+        t = self.table
+        active = np.flatnonzero(t['id'] >= 0)
+        matched_tracks, matched_dets = self._associate(active, det_pos, timestamp)
+
+        if len(matched_tracks):
+            # velocity over the time since each track was last seen, which spans missed frames
+            old = np.stack((t['x'][matched_tracks], t['y'][matched_tracks]), axis=1)
+            new = det_pos[matched_dets]
+            elapsed = timestamp - t['last_seen'][matched_tracks]
+            moved = matched_tracks[elapsed > 0]
+            if len(moved):
+                v = (new[elapsed > 0] - old[elapsed > 0]) / elapsed[elapsed > 0, None]
+                a = self.velocity_smoothing
+                t['vx'][moved] += a * (v[:,0] - t['vx'][moved])
+                t['vy'][moved] += a * (v[:,1] - t['vy'][moved])
+            self._set(matched_tracks, matched_dets, det_pos, det_raw, det_T, timestamp)
+
+        missed = np.setdiff1d(active, matched_tracks)
+        t['missed'][missed] += 1
+        t['id'][missed[t['missed'][missed] > self.max_missed]] = -1
+
+        new_dets = np.setdiff1d(np.arange(len(det_pos)), matched_dets)
+        free = np.flatnonzero(t['id'] < 0)[:len(new_dets)]
+        new_dets = new_dets[:len(free)]
+        if len(free):
+            t[free] = np.zeros(1, dtype=TRACK_DTYPE)
+            t['id'][free] = np.arange(self.next_id, self.next_id + len(free))
+            self.next_id += len(free)
+            self.history_T[free] = np.nan
+            self._set(free, new_dets, det_pos, det_raw, det_T, timestamp)
+
+        return self.tracks()
+
+    def _associate(self, active, det_pos, timestamp):
+        # greedy nearest neighbour matching against the positions predicted from the last detection
+        if len(active) == 0 or len(det_pos) == 0:
+            return np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp)
+        t = self.table[active]
+        elapsed = timestamp - t['last_seen']
+        predicted = np.stack((t['x'] + t['vx'] * elapsed, t['y'] + t['vy'] * elapsed), axis=1)
+        dist = np.linalg.norm(predicted[:,None,:] - det_pos[None,:,:], axis=2)
+        tracks, dets = [], []
+        for _ in range(min(dist.shape)):
+            i, j = np.unravel_index(np.argmin(dist), dist.shape)
+            if dist[i, j] > self.max_distance: break
+            tracks.append(active[i])
+            dets.append(j)
+            dist[i,:] = np.inf
+            dist[:,j] = np.inf
+        return np.array(tracks, dtype=np.intp), np.array(dets, dtype=np.intp)
+
+    def _set(self, slots, dets, det_pos, det_raw, det_T, timestamp):
+        t = self.table
+        t['x'][slots] = det_pos[dets, 0]
+        t['y'][slots] = det_pos[dets, 1]
+        t['raw'][slots] = det_raw[dets]
+        t['T'][slots] = det_T[dets]
+        t['missed'][slots] = 0
+        t['last_seen'][slots] = timestamp
+        idx = t['hits'][slots] % self.history_T.shape[1]
+        self.history_T[slots, idx] = det_T[dets]
+        self.history_t[slots, idx] = timestamp
+        t['hits'][slots] += 1
+
+    def tracks(self):
+        return self.table[self.table['id'] >= 0]
+
+    def history(self, track_id):
+        # (timestamps, temperatures) of a track, oldest first
+        slot = np.flatnonzero(self.table['id'] == track_id)
+        if len(slot) == 0:
+            return np.zeros(0), np.zeros(0, dtype=np.float32)
+        slot = slot[0]
+        n, size = self.table['hits'][slot], self.history_T.shape[1]
+        order = np.arange(max(0, n - size), n) % size
+        return self.history_t[slot, order], self.history_T[slot, order]
@@ -2,7 +2,6 @@
 import time
 import numpy as np
 import math
-import cv2
 from datetime import datetime
 from sys import platform
 
@@ -30,10 +29,7 @@ ABSOLUTE_ZERO_CELSIUS = -273.15
 #fpa - focal-plane array (sensor)
 
 
-def sub_10001180(fpatmp_, coretmp_, cx, high_range = False):
-    global Distance_, refltmp_, airtmp_, Humi_, Emiss_
-    global flt_1000335C, flt_10003360, flt_1000339C, flt_10003394, flt_10003398
-
+def atmosphereTransmittance(airtmp_, Humi_, Distance_):
     # based on:
     # https://www.mdpi.com/1424-8220/17/8/1718 page: 4
     # https://github.com/mcguire-steve/ht301_ircam
@@ -62,11 +58,19 @@ def sub_10001180(fpatmp_, coretmp_, cx, high_range = False):
     if debug > 0:
         print('water vapour content coefficient:', w)
         print('transmittance of atmosphere:     ', t)
+    return t
 
-    part_emi_t_1 = 1.0 / (Emiss_ * t)
-    part_Tatm_Trefl = (1.0 - Emiss_) * t * (refltmp_ - ABSOLUTE_ZERO_CELSIUS)**4  +  (1.0 - t) * (airtmp_ - ABSOLUTE_ZERO_CELSIUS)**4
 
-#---------------------
+def distanceCorrection(Distance_):
+    if (Distance_ >= 20):
+        return (20        * 0.85 - 1.125) / 100.
+    else:
+        return (Distance_ * 0.85 - 1.125) / 100.
+
+
+def totalTemperatureLut(fpatmp_, coretmp_, cx, coeffs, high_range = False):
+    # temperature (K) of the total radiation received for every raw value
+    flt_10003360, flt_1000335C, flt_1000339C, flt_10003398, flt_10003394 = coeffs
     # a1 = coretmp_
     # flt_100033A4 = fpatmp_ 
 
@@ -80,34 +84,172 @@ def sub_10001180(fpatmp_, coretmp_, cx, high_range = False):
     if high_range:
         v2 = 0
     else:
-        v2 = int(390.0 - fpatmp_ * 7.05)
+        v2 = np.trunc(390.0 - fpatmp_ * 7.05) # like int(), but also for (N, 1) batches
     v4 = cx - v2
     v5 = -v4
-    if (Distance_ >= 20):
-        distance_c = (20        * 0.85 - 1.125) / 100.
-    else:
-        distance_c = (Distance_ * 0.85 - 1.125) / 100.
 
     np_v5 = np.arange(16384.0) - v4
     np_v8 = (np_v5 * v22 + v23) / flt_10003360 + l_flt_1000337C_2
     np_Ttot = np_v8**0.5 - l_flt_1000337C - ABSOLUTE_ZERO_CELSIUS
-    np_Tobj_C = ((np_Ttot**4 - part_Tatm_Trefl) * part_emi_t_1)**0.25 + ABSOLUTE_ZERO_CELSIUS
-    np_result = np_Tobj_C + distance_c * (np_Tobj_C - airtmp_)
 
     if debug > 1:
-        v = np_result.tolist()
         print('cx:', cx, 'v2:', v2)
         print('v5:', v5)
         print('flt_1000339C', flt_1000339C, 'flt_10003398', flt_10003398, 'flt_10003394', flt_10003394, 'fpatmp_', fpatmp_)
         print('v22:', v22)
         print('v23:', v23)
+    return np_Ttot
+
+
+def radiometricTerms(Emiss_, refltmp_, airtmp_, t):
+    # works on scalars as well as on per pixel arrays of emissivity / reflected temperature
+    part_emi_t_1 = 1.0 / (Emiss_ * t)
+    part_Tatm_Trefl = (1.0 - Emiss_) * t * (refltmp_ - ABSOLUTE_ZERO_CELSIUS)**4  +  (1.0 - t) * (airtmp_ - ABSOLUTE_ZERO_CELSIUS)**4
+    return part_emi_t_1, part_Tatm_Trefl
+
+
+def objectTemperature(np_Ttot, part_emi_t_1, part_Tatm_Trefl, airtmp_, distance_c):
+    np_Tobj_C = ((np_Ttot**4 - part_Tatm_Trefl) * part_emi_t_1)**0.25 + ABSOLUTE_ZERO_CELSIUS
+    return np_Tobj_C + distance_c * (np_Tobj_C - airtmp_)
+
+
+def sub_10001180(fpatmp_, coretmp_, cx, high_range = False):
+    global Distance_, refltmp_, airtmp_, Humi_, Emiss_
+    global flt_1000335C, flt_10003360, flt_1000339C, flt_10003394, flt_10003398
+
+    t = atmosphereTransmittance(airtmp_, Humi_, Distance_)
+    coeffs = (flt_10003360, flt_1000335C, flt_1000339C, flt_10003398, flt_10003394)
+    np_Ttot = totalTemperatureLut(fpatmp_, coretmp_, cx, coeffs, high_range)
+    part_emi_t_1, part_Tatm_Trefl = radiometricTerms(Emiss_, refltmp_, airtmp_, t)
+    np_result = objectTemperature(np_Ttot, part_emi_t_1, part_Tatm_Trefl, airtmp_, distanceCorrection(Distance_))
+
+    if debug > 1:
+        v = np_result.tolist()
         print('np1:', v[:10])
         print('np2:', v[-10:])
     return np_result
 
 
 
-def temperatureLut(fpatmp_, meta3, high_range=False):
+# atmospheric / emissivity parameters stored in the meta data by the device
+PARAMETERS = ('Fix', 'refltmp', 'airtmp', 'Humi', 'Emiss', 'Distance')
+
+def checkParameter(name, value):
+    # ValueError for values the LUT math can't take, negative humidity or
+    # distance end up as roots of negative numbers in atmosphereTransmittance()
+    if name not in PARAMETERS:
+        raise ValueError('unknown parameter: ' + name)
+    if not math.isfinite(value):
+        raise ValueError('%s has to be finite: %r' % (name, value))
+    if name in ('Humi', 'Distance') and value < 0:
+        raise ValueError('%s can not be negative: %r' % (name, value))
+    return value
+
+def readParameters(meta3):
+    m3 = meta3.view(dtype=np.dtype(np.uint8))
+    return {
+        'cx': int(meta3[0]),
+        'coretmp': float(meta3[1]) / 10.0 + ABSOLUTE_ZERO_CELSIUS,
+        'coeffs': (f32(m3, 6), f32(m3, 10), f32(m3, 14), f32(m3, 18), f32(m3, 22)),
+        'Fix': f32(m3,127*2),
+        'refltmp': f32(m3,127*2 + 4),
+        'airtmp': f32(m3,127*2 + 8),
+        'Humi': f32(m3,127*2 + 12),
+        'Emiss': f32(m3,127*2 + 16),
+        'Distance': u16(m3,127*2 + 20),
+    }
+
+def fpaTemperature(meta0):
+    Tfpa_raw = meta0[1]
+    return 20.0 - (float(Tfpa_raw) - 7800.0) / 36.0
+
+def temperatureLuts(meta, high_range=False, parameters=None, chunk=8):
+    # temperatureLut() for a batch of (N, 4, width) meta blocks, returns
+    # (N, 16384) LUTs in C, equal to the ones of temperatureLut(). The meta
+    # blocks are parsed at once, the atmosphere / emissivity terms come from
+    # the scalar functions once per distinct parameter set and the math per
+    # raw value runs in place on chunks of states.
+    meta = np.asarray(meta)
+    meta3 = np.ascontiguousarray(meta[:, 3])
+    m3 = meta3.view(np.uint8)
+    fpatmp_ = 20.0 - (meta[:, 0, 1].astype(np.float64) - 7800.0) / 36.0
+    coretmp_ = meta3[:, 1] / 10.0 + ABSOLUTE_ZERO_CELSIUS
+    cx = meta3[:, 0].astype(np.float64)
+    coeffs = np.ascontiguousarray(m3[:, 6:26]).view(np.float32).astype(np.float64)
+    # PARAMETERS: 5 float32 and the u16 distance
+    p = np.empty((len(meta), len(PARAMETERS)))
+    p[:, :5] = np.ascontiguousarray(m3[:, 127*2:127*2 + 20]).view(np.float32)
+    p[:, 5] = np.ascontiguousarray(m3[:, 127*2 + 20:127*2 + 22]).view(np.uint16)[:, 0]
+    for name, value in (parameters or {}).items():
+        p[:, PARAMETERS.index(name)] = value
+
+    # part_emi_t_1, part_Tatm_Trefl, airtmp_, distance_c per state
+    unique, inverse = np.unique(p, axis=0, return_inverse=True)
+    terms = np.full((len(unique), 4), np.nan)
+    for i, (Fix, refltmp, airtmp, Humi, Emiss, Distance) in enumerate(unique.tolist()):
+        if abs(Emiss) < 0.0001: continue
+        t = atmosphereTransmittance(airtmp, Humi, Distance)
+        terms[i] = (*radiometricTerms(Emiss, refltmp, airtmp, t), airtmp, distanceCorrection(Distance))
+    terms = terms[inverse.reshape(-1)]
+
+    # same fallback as temperatureLut()
+    luts = np.empty((len(meta), 16384))
+    invalid = (np.abs(p[:, 4]) < 0.0001) | (np.abs(coeffs[:, 0]) < 0.0001)
+    luts[invalid] = np.arange(16384.0)
+    valid = np.flatnonzero(~invalid)
+
+    # same operations as totalTemperatureLut() / objectTemperature() on
+    # (chunk, 1) columns, in place on one (chunk, 16384) buffer
+    raw = np.arange(16384.0)
+    buf = np.empty((min(chunk, len(valid)), 16384))
+    tmp = np.empty_like(buf)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for i in range(0, len(valid), chunk):
+            index = valid[i:i+chunk]
+            n = len(index)
+            b, c = buf[:n], tmp[:n]
+            column = lambda v: v[index, None]
+            f60, f5C, f9C, f98, f94 = (column(coeffs[:, k]) for k in range(5))
+            fpa, core = column(fpatmp_), column(coretmp_)
+            part_emi_t_1, part_Tatm_Trefl, airtmp, distance_c = (column(terms[:, k]) for k in range(4))
+
+            l_flt_1000337C = f5C / (2.0 * f60)
+            v23 = f60 * core**2 + f5C * core
+            v22 = f9C * fpa**2 + f98 * fpa + f94
+            v2 = 0 if high_range else np.trunc(390.0 - fpa * 7.05)
+            np.subtract(raw, column(cx) - v2, out=b)
+            b *= v22
+            b += v23
+            b /= f60
+            b += l_flt_1000337C**2
+            np.sqrt(b, out=b)
+            b -= l_flt_1000337C
+            b -= ABSOLUTE_ZERO_CELSIUS
+            np.power(b, 4, out=b)
+            b -= part_Tatm_Trefl
+            b *= part_emi_t_1
+            np.power(b, 0.25, out=b)
+            b += ABSOLUTE_ZERO_CELSIUS
+            np.subtract(b, airtmp, out=c)
+            c *= distance_c
+            b += c
+            luts[index] = b
+    return luts
+
+
+def calibrationFingerprint(meta, high_range=False, parameters=None):
+    # everything the temperature LUT depends on: raw fpa temperature, core
+    # temperature, cx, calibration coefficients and the parameter block
+    meta0, meta3 = meta[0], meta[3]
+    block = meta3[127:138].tobytes()
+    if parameters:
+        # host side parameters replace the device ones
+        p = readParameters(meta3)
+        block = tuple(parameters.get(k, p[k]) for k in PARAMETERS)
+    return (int(meta0[1]), meta3[:13].tobytes(), block, bool(high_range))
+
+
+def temperatureLut(fpatmp_, meta3, high_range=False, parameters=None):
 
     global Fix_, Distance_, refltmp_, airtmp_, Humi_, Emiss_
     global fpaavg_, orgavg_, coretmp_ 
@@ -117,25 +259,20 @@ def temperatureLut(fpatmp_, meta3, high_range=False):
     global flt_10003394
 
     m3 = meta3.view(dtype=np.dtype(np.uint8))
+    p = readParameters(meta3)
 
-    v5 = meta3[0]
-    coretmp_ = float(meta3[1]) / 10.0 + ABSOLUTE_ZERO_CELSIUS
+    v5 = p['cx']
+    coretmp_ = p['coretmp']
 
-    flt_10003360 = f32(m3, 6)
-    flt_1000335C = f32(m3, 10)
-    flt_1000339C = f32(m3, 14)
-    flt_10003398 = f32(m3, 18)
-    flt_10003394 = f32(m3, 22)
+    flt_10003360, flt_1000335C, flt_1000339C, flt_10003398, flt_10003394 = p['coeffs']
     readParaFromDevFlag = True
     if readParaFromDevFlag:
         if debug > 0: print('m3:', m3[127*2:127*2+30])
-        Fix_ = f32(m3,127*2)
-        refltmp_ = f32(m3,127*2 + 4)
-        airtmp_ = f32(m3,127*2 + 8)
-        Humi_ = f32(m3,127*2 + 12)
-        Emiss_ = f32(m3,127*2 + 16)
-        Distance_ = u16(m3,127*2 + 20)
+        Fix_, refltmp_, airtmp_, Humi_, Emiss_, Distance_ = (p[k] for k in PARAMETERS)
         #readParaFromDevFlag = 0;
+    if parameters:
+        # host side values, see HT301.setParameters()
+        Fix_, refltmp_, airtmp_, Humi_, Emiss_, Distance_ = (parameters.get(k, p[k]) for k in PARAMETERS)
 
     if debug > 0:
         print('Fix_',Fix_)
@@ -161,30 +298,31 @@ def temperatureLut(fpatmp_, meta3, high_range=False):
     return sub_10001180(fpatmp_, coretmp_, v5, high_range) #//bug in IDA
 
 
-def info(meta, device_strings, width, height, high_range=False):
+def info(meta, device_strings, width, height, high_range=False, parameters=None, temperature_LUT_C=None, date=None):
 
     meta0, meta3 = meta[0], meta[3]
 
     Tfpa_raw = meta0[1]
-    fpatmp_ = 20.0 - (float(Tfpa_raw) - 7800.0) / 36.0
+    fpatmp_ = fpaTemperature(meta0)
 
-    temperature_LUT_C = temperatureLut(fpatmp_, meta3, high_range)
+    if temperature_LUT_C is None:
+        temperature_LUT_C = temperatureLut(fpatmp_, meta3, high_range, parameters)
 
-    fpaavg_  = meta0[0]
+    fpaavg_  = int(meta0[0])
 #   Tfpa_raw = meta0[1]
-    Tmax_x   = meta0[2]
-    Tmax_y   = meta0[3]
-    Tmax_raw = meta0[4]
-    Tmin_x   = meta0[5]
-    Tmin_y   = meta0[6]
-    Tmin_raw = meta0[7]
+    Tmax_x   = int(meta0[2])
+    Tmax_y   = int(meta0[3])
+    Tmax_raw = int(meta0[4])
+    Tmin_x   = int(meta0[5])
+    Tmin_y   = int(meta0[6])
+    Tmin_raw = int(meta0[7])
 
-    orgavg_  = meta0[8]
+    orgavg_  = int(meta0[8])
 
-    Tcenter_raw = meta0[12]
-    Tarr0_raw = meta0[13]
-    Tarr1_raw = meta0[14]
-    Tarr2_raw = meta0[15]
+    Tcenter_raw = int(meta0[12])
+    Tarr0_raw = int(meta0[13])
+    Tarr1_raw = int(meta0[14])
+    Tarr2_raw = int(meta0[15])
 
     r_info = {
         'Tmin_C': temperature_LUT_C[Tmin_raw],
@@ -198,7 +336,7 @@ def info(meta, device_strings, width, height, high_range=False):
         'Tcenter_point': (int(width/2), int(height/2)),
         'device_strings': device_strings,
         'device_type': device_strings[3],
-        'date': datetime.now(),
+        'date': date if date is not None else datetime.now(),
         'meta': meta
     }
 
@@ -238,13 +376,74 @@ def device_info(meta):
 
 
 
+class ThermalFrame:
+    # One captured frame: the raw buffer (visible frame + 4 meta rows) with the
+    # sensor state it was captured with. It is read-only and owns its buffer,
+    # so it can be handed to several consumers (recorder, display, analytics)
+    # without copies. The info / LUT are only computed when asked for.
+    # settling marks frames captured while the shutter is closed or the sensor
+    # settles after a mode switch (see scheduler.py), they are not for statistics.
+    # np.asarray(frame) and memoryview(frame) (Python 3.12+) give the raw buffer.
+    __slots__ = ('raw', 'frame', 'meta', 'timestamp', 'sequence', 'device_strings',
+                 'high_range', 'parameters', 'settling', 'date', '_lut_source', '_info', '_lut')
+
+    def __init__(self, raw, timestamp, sequence, device_strings = None, high_range = False, parameters = None, lut_source = None, settling = False, date = None):
+        raw = raw.view()
+        raw.flags.writeable = False
+        init = object.__setattr__
+        init(self, 'raw', raw)
+        init(self, 'frame', raw[:-4])
+        init(self, 'meta', raw[-4:])
+        init(self, 'timestamp', timestamp)
+        init(self, 'sequence', sequence)
+        init(self, 'device_strings', device_strings if device_strings is not None else device_info(raw[-4:]))
+        init(self, 'high_range', high_range)
+        init(self, 'parameters', dict(parameters) if parameters else {})
+        init(self, 'settling', settling)
+        # wall clock capture time for info()['date'], which is computed later
+        init(self, 'date', date if date is not None else datetime.now())
+        init(self, '_lut_source', lut_source)
+        init(self, '_info', None)
+        init(self, '_lut', None)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('ThermalFrame is immutable')
+
+    def __delattr__(self, name):
+        raise AttributeError('ThermalFrame is immutable')
+
+    def info(self):
+        if self._info is None:
+            height, width = self.frame.shape
+            lut = self._lut_source(self.meta, self.high_range, self.parameters) if self._lut_source else None
+            r_info, lut = info(self.meta, self.device_strings, width, height, self.high_range, self.parameters, lut, self.date)
+            object.__setattr__(self, '_lut', lut)
+            object.__setattr__(self, '_info', r_info)
+        return self._info, self._lut
+
+    @property
+    def __array_interface__(self):
+        return self.raw.__array_interface__
+
+    def __buffer__(self, flags):
+        return memoryview(self.raw)
+
+    def __repr__(self):
+        return 'ThermalFrame(sequence=%d, timestamp=%.3f, high_range=%s, settling=%s)' % (self.sequence, self.timestamp, self.high_range, self.settling)
+
+
 class HT301:
     FRAME_RAW_WIDTH = 384
     FRAME_RAW_HEIGHT = 292
     FRAME_WIDTH = FRAME_RAW_WIDTH
     FRAME_HEIGHT = FRAME_RAW_HEIGHT - 4
 
-    def __init__(self, video_dev = None):
+    # calibrate=False leaves the first calibration to the caller, e.g. to a
+    # SensorScheduler that tags the frames captured while the shutter is closed
+    def __init__(self, video_dev = None, calibrate = True):
+        # OpenCV is only needed to talk to the device, imported here once
+        import cv2
+        self.cv2 = cv2
 
         if video_dev == None:
             video_dev = self.find_device()
@@ -264,12 +463,16 @@ class HT301:
         # Use raw mode
         self.cap.set(cv2.CAP_PROP_ZOOM, 0x8004)
         # Calibrate
-        self.calibrate()
+        if calibrate:
+            self.calibrate()
         #? enable thermal data - not needed
         #self.cap.set(cv2.CAP_PROP_ZOOM, 0x8020)
         self.frame_raw = None
         self.frame = None
         self.high_range = False
+        self.parameters = {}
+        self.lut_cache = (None, None) # (calibration fingerprint, LUT)
+        self.sequence = 0
 
     def __enter__(self):
         return self
@@ -281,8 +484,8 @@ class HT301:
         if not cap.isOpened():
             if debug > 0: print('open failed!')
             return False
-        w = cap.get(cv2.CAP_PROP_FRAME_WIDTH)
-        h = cap.get(cv2.CAP_PROP_FRAME_HEIGHT)
+        w = cap.get(self.cv2.CAP_PROP_FRAME_WIDTH)
+        h = cap.get(self.cv2.CAP_PROP_FRAME_HEIGHT)
         if debug > 0: print('width:', w, 'height:', h)
         if w == self.FRAME_RAW_WIDTH and h == self.FRAME_RAW_HEIGHT: return True
         return False
@@ -290,7 +493,7 @@ class HT301:
     def find_device(self):
         for i in range(10):
             if debug > 0: print('testing device nr:',i)
-            cap = cv2.VideoCapture(i)
+            cap = self.cv2.VideoCapture(i)
             ok = self.isHt301(cap)
             cap.release()
             if ok: return i
@@ -316,30 +519,67 @@ class HT301:
             elif device_strings[5] == 'T3S-A13': frame_ok = True
             else:
                 if debug > 0: print('frame meta no match:', device_strings)
-                if self.frame_raw != None:
+                if self.frame_raw is not None:
                     return False, self.frame
 
         self.frame_raw = frame_raw
         self.frame = frame
         self.meta  = meta
         self.device_strings  = device_strings
+        self.sequence += 1
         return ret, self.frame
 
+    def readFrame(self, scheduler = None):
+        # next frame as ThermalFrame, None if no valid frame was read,
+        # a SensorScheduler is updated with the frame and tells if it is settling
+        ret, _ = self.read()
+        if not ret:
+            return None
+        settling = scheduler.update(self.meta) if scheduler is not None else False
+        return ThermalFrame(self.frame_raw, time.monotonic(), self.sequence, self.device_strings,
+                            self.high_range, self.parameters, self.temperatureTable, settling)
+
+    def temperatureTable(self, meta, high_range, parameters):
+        # the LUT is only regenerated when one of its inputs changes,
+        # key and LUT are swapped together as frames may ask from other threads
+        key = calibrationFingerprint(meta, high_range, parameters)
+        lut_key, lut = self.lut_cache
+        if key != lut_key:
+            lut = temperatureLut(fpaTemperature(meta[0]), meta[3], high_range, parameters)
+            self.lut_cache = (key, lut)
+        return lut
+
     def info(self):
         width, height = self.frame.shape
-        return info(self.meta, self.device_strings, height, width, self.high_range)
+        lut = self.temperatureTable(self.meta, self.high_range, self.parameters)
+        return info(self.meta, self.device_strings, height, width, self.high_range, self.parameters, lut)
+
+    # Pin atmospheric / emissivity parameters (see PARAMETERS) on the host
+    # instead of using the values stored in the device, None unpins.
+    # e.g. cap.setParameters(Emiss=0.95, Distance=2)
+    def setParameters(self, **parameters):
+        for name, value in parameters.items():
+            if value is None:
+                if name not in PARAMETERS:
+                    raise ValueError('unknown parameter: ' + name)
+                self.parameters.pop(name, None)
+            else:
+                self.parameters[name] = checkParameter(name, value)
 
     def calibrate(self):
-        self.cap.set(cv2.CAP_PROP_ZOOM, 0x8000)
+        self.cap.set(self.cv2.CAP_PROP_ZOOM, 0x8000)
 
     # Experimental feature, use with caution. Temperatures reported in high temp mode seem to be too high at lower end.
-    def useHighTempRange(self, enable):
+    # Only sends the mode switch, the sensor needs time to settle and a calibration afterwards (see scheduler.py).
+    def setHighTempRange(self, enable):
         if enable:
-            self.cap.set(cv2.CAP_PROP_ZOOM, 0x8021) # max 400C
+            self.cap.set(self.cv2.CAP_PROP_ZOOM, 0x8021) # max 400C
         else:
-            self.cap.set(cv2.CAP_PROP_ZOOM, 0x8020) # max 120C
-
+            self.cap.set(self.cv2.CAP_PROP_ZOOM, 0x8020) # max 120C
         self.high_range = enable
+
+    def useHighTempRange(self, enable):
+        self.setHighTempRange(enable)
         time.sleep(0.5)
         self.calibrate()
 
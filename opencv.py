@@ -1,24 +1,37 @@
 #!/usr/bin/python3
 import math
 import time
-from argparse import ArgumentParser
+from argparse import ArgumentParser, ArgumentTypeError
 import numpy as np
 import cv2
 
 import ht301_hacklib
+from autoexposure import AutoExposure, searchLut
+from hotspots import HotspotTracker
+from recording import Recorder
+from scheduler import SensorScheduler
+from regions import Region
+import colormaps
 
 class FrameProcessor:
-    def __init__(self, width, height, scale, color_map, temp_range):
+    def __init__(self, width, height, scale, color_map, temp_range, region = None, isotherm = None):
+        # with a region only its (strided) view of the frame is processed and shown
+        self.region = region
+        if region is not None:
+            height, width = region.shape
         self.width = width * scale
         self.height = height * scale
         self.scale = scale
-        self.color_map = color_map
+        self.color_map = color_map # name, see colormaps.COLORMAPS
+        self.isotherm = isotherm   # (FROM, TO) temperature band highlighted in the image
         if temp_range:
             self.min_temp = temp_range[0]
             self.max_temp = temp_range[1]
         else:
             self.min_temp = None
             self.max_temp = None
+        self.auto_exposure = AutoExposure()
+        self.exposure = {'T_min': 0., 'T_max': 50., 'T_margin': 2.0}
 
         self.legend_width = 55 * scale
         self.bar_hspace = 15 * scale
@@ -31,6 +44,15 @@ class FrameProcessor:
             self.font = cv2.FONT_HERSHEY_PLAIN
             self.font_scale = 1
 
+        # legend gradient, marker cross and text labels are rendered once and cached
+        self.gradient = None
+        self.legend = None
+        self.legend_key = None
+        self.cross = None
+        self.sprites = {}
+        # colorized image before the BGRA -> BGR conversion, reused for every frame
+        self.colorized = None
+
 
     def getWidth(self, withLegend):
         if withLegend:
@@ -43,67 +65,152 @@ class FrameProcessor:
         return self.height
 
 
-    def processImage(self, frame, info):
-        if self.min_temp or self.max_temp:
-            fmin = frame.min()
-            fmax = frame.max()
-            d = (fmax - fmin) / (info['Tmax_C'] - info['Tmin_C'])
-            vmin = fmin + (self.min_temp - info['Tmin_C']) * d
-            vmax = fmax + (self.max_temp - info['Tmax_C']) * d
-        else:
-            vmin = frame.min()
-            vmax = frame.max()
-
-        # Sketchy auto-exposure
-        frame = frame.astype(np.float32)
-        frame -= vmin
-        frame /= (vmax - vmin)
+    def updateExposure(self, frame, lut):
+        # auto exposure only, to settle it on frames that are not shown
+        if self.region is not None:
+            frame = self.region.view(frame)
+        self.auto_exposure.update(False, self.exposure, frame, lut)
 
-        frame = (np.clip(frame, 0, 1)*255).astype(np.uint8)
 
+    def processImage(self, frame, info, lut, out = None, settling = False, exposure = None):
+        if self.region is not None:
+            frame = self.region.view(frame)
+        if self.min_temp or self.max_temp:
+            # the LUT is monotonic, so the fixed range maps back to raw values
+            vmin, vmax = (int(v) for v in searchLut(lut, (self.min_temp, self.max_temp)))
+            vmax = max(vmax, vmin + 1)
+        else:
+            # exposure: (T_min, T_max) of an earlier auto exposure pass over the frames,
+            # frames captured during calibration / mode switch would disturb the auto exposure
+            if exposure is not None:
+                self.exposure['T_min'], self.exposure['T_max'] = exposure
+            elif not settling:
+                self.auto_exposure.update(False, self.exposure, frame, lut)
+            vmin, vmax = self.auto_exposure.rawRange(self.exposure, lut)
+
+        # raw values are interpolated before colorizing, interpolated colors
+        # would leave the palette and overshoot with cubic interpolation
         if self.scale != 1:
-            frame = cv2.resize(frame, dsize=(self.width, self.height), interpolation=cv2.INTER_CUBIC)
+            frame = cv2.resize(np.ascontiguousarray(frame), dsize=(self.width, self.height), interpolation=cv2.INTER_LINEAR)
 
-        return cv2.applyColorMap(frame, self.color_map)
+        # colorized with one gather from the cached color table
+        isotherm = colormaps.isothermRange(lut, *self.isotherm) if self.isotherm else None
+        table = colormaps.colorTable(self.color_map, vmin, vmax, isotherm=isotherm)
+        if self.colorized is None or self.colorized.shape[:2] != frame.shape:
+            self.colorized = np.empty(frame.shape + (4,), dtype=np.uint8)
+        return cv2.cvtColor(colormaps.colorize(frame, table, self.colorized), cv2.COLOR_BGRA2BGR, dst=out)
 
 
     def _generateGradient(self):
-        color_lut = cv2.applyColorMap(np.array(range(256), dtype=np.uint8), self.color_map)
+        color_lut = colormaps.palette(self.color_map)[:, ::-1]
         self.gradient = np.zeros((self.height, self.legend_width, 3), dtype=np.uint8)
-        gradient_height = self.height - 2 * self.text_vspace
+        gradient_height = max(self.height - 2 * self.text_vspace, 0) # small crops leave no room for the bar
         y_start = self.bar_hspace
         y_end = self.legend_width - self.bar_hspace
 
-        for index in range(gradient_height):
-            color = color_lut[int(0xff - (index * 0x100 / gradient_height))][0]
-            self.gradient[index + self.text_vspace][y_start:y_end] = color
+        index = (0xff - (np.arange(gradient_height) * 0x100 / gradient_height)).astype(int)
+        self.gradient[self.text_vspace:self.text_vspace + gradient_height, y_start:y_end] = color_lut[index][:,None,:]
+
+
+    def _textSprite(self, text, color, outline_col = None):
+        # text pre-rendered once as (premultiplied color, 255 - alpha, text size, origin in sprite)
+        key = (text, color, outline_col)
+        sprite = self.sprites.get(key)
+        if sprite is None:
+            if len(self.sprites) > 1024: self.sprites.clear()
+            dsize = 1
+            (w, h), baseline = cv2.getTextSize(text, self.font, 1, dsize)
+            pad = 2 * self.font_scale + 2
+            image = np.zeros((h + baseline + 2 * pad, w + 2 * pad, 3), dtype=np.uint8)
+            alpha = np.zeros_like(image)
+            ox, oy = pad, pad + h
+            if outline_col is not None:
+                for offset in (-self.font_scale, self.font_scale):
+                    for (dx, dy) in ((offset, 0), (0, offset)):
+                        cv2.putText(image, text, (ox + dx, oy + dy), self.font, 1, outline_col, dsize, cv2.LINE_8)
+                        cv2.putText(alpha, text, (ox + dx, oy + dy), self.font, 1, (255,255,255), dsize, cv2.LINE_8)
+            cv2.putText(image, text, (ox, oy), self.font, 1, color, dsize, cv2.LINE_8)
+            cv2.putText(alpha, text, (ox, oy), self.font, 1, (255,255,255), dsize, cv2.LINE_8)
+            sprite = self.sprites[key] = self._sprite(image, alpha, (w, h), (ox, oy))
+        return sprite
+
+
+    def _crossSprite(self):
+        if self.cross is None:
+            draw_col, outline_col = (255,255,255), (0,0,0)
+            d1, d2 = 3 * self.font_scale, 6 * self.font_scale
+            dsize = 1
+            c = d2 + 3 * self.font_scale
+            image = np.zeros((2 * c + 1, 2 * c + 1, 3), dtype=np.uint8)
+            alpha = np.zeros_like(image)
+            for (color, width) in [(outline_col, 3 * dsize * self.font_scale - 1), (draw_col, dsize * self.font_scale)]:
+                for (img, col) in ((image, color), (alpha, (255,255,255))):
+                    cv2.line(img, (c+d1, c), (c+d2,c), col, width)
+                    cv2.line(img, (c-d1, c), (c-d2,c), col, width)
+                    cv2.line(img, (c, c+d1), (c,c+d2), col, width)
+                    cv2.line(img, (c, c-d1), (c,c-d2), col, width)
+            self.cross = self._sprite(image, alpha, (0, 0), (c, c))
+        return self.cross
+
+
+    def _sprite(self, image, alpha, size, origin):
+        # crop to the drawn pixels, drawing on black gives premultiplied colors
+        ys, xs = np.nonzero(alpha[...,0])
+        y1, y2, x1, x2 = ys.min(), ys.max() + 1, xs.min(), xs.max() + 1
+        return (image[y1:y2, x1:x2].copy(), 255 - alpha[y1:y2, x1:x2], size, (origin[0] - x1, origin[1] - y1))
+
+
+    def _blit(self, img, sprite, point):
+        # alpha blend the sprite with its origin at point, clipped to img
+        image, inv_alpha, _, (ox, oy) = sprite
+        x, y = point[0] - ox, point[1] - oy
+        x1, y1 = max(x, 0), max(y, 0)
+        x2, y2 = min(x + image.shape[1], img.shape[1]), min(y + image.shape[0], img.shape[0])
+        if x1 >= x2 or y1 >= y2:
+            return
+        sx, sy = x1 - x, y1 - y
+        sprite_roi = (slice(sy, sy + y2 - y1), slice(sx, sx + x2 - x1))
+        roi = img[y1:y2, x1:x2]
+        cv2.multiply(roi, inv_alpha[sprite_roi], dst=roi, scale=1/255.)
+        cv2.add(roi, image[sprite_roi], dst=roi)
+
+
+    def _legendText(self, T):
+        if math.isnan(T):
+            return "Nan"
+        else:
+            return f"{round(T)}C"
 
 
-    def _drawTemperatureCentered(self, img, point, dims, T, font, color = (0,0,0)):
+    def _drawTemperatureCentered(self, img, point, dims, T, color = (0,0,0)):
         (x, y) = point
         (width, height) = dims
-        if math.isnan(T):
-            text = "Nan"
-        else:
-            text = f"{round(T)}C"
-        dsize = 1
+        text = self._legendText(T)
 
-        (text_length, text_height) = cv2.getTextSize(text, font, 1, dsize)[0]
+        sprite = self._textSprite(text, color)
+        (text_length, text_height) = sprite[2]
         text_x = x + round((width - text_length) / 2)
         text_y = y + height - round((height - text_height) / 2)
-        cv2.putText(img, text, (text_x, text_y), font, 1, color, dsize, cv2.LINE_8)
+        self._blit(img, sprite, (text_x, text_y))
 
 
-    def addLegend(self, frame, info):
-        if not hasattr(self, "gradient"):
+    def _legendImage(self):
+        if self.gradient is None:
             self._generateGradient()
 
-        legend = np.copy(self.gradient)
-        max_temp = self.max_temp if self.max_temp != None else info['Tmax_C']
-        min_temp = self.min_temp if self.min_temp != None else info['Tmin_C']
-        self._drawTemperatureCentered(legend, (0, 0), (self.legend_width, self.text_vspace), max_temp, self.font, (255,255,255))
-        self._drawTemperatureCentered(legend, (0, self.height - self.text_vspace), (self.legend_width, self.text_vspace), min_temp, self.font, (255,255,255))
-        return np.concatenate((frame, legend), axis=1)
+        max_temp = self.max_temp if self.max_temp != None else self.exposure['T_max']
+        min_temp = self.min_temp if self.min_temp != None else self.exposure['T_min']
+        key = (self._legendText(max_temp), self._legendText(min_temp))
+        if key != self.legend_key:
+            self.legend = np.copy(self.gradient)
+            self._drawTemperatureCentered(self.legend, (0, 0), (self.legend_width, self.text_vspace), max_temp, (255,255,255))
+            self._drawTemperatureCentered(self.legend, (0, self.height - self.text_vspace), (self.legend_width, self.text_vspace), min_temp, (255,255,255))
+            self.legend_key = key
+        return self.legend
+
+
+    def addLegend(self, frame, info):
+        return np.concatenate((frame, self._legendImage()), axis=1)
 
 
     def _scalePoint(self, point, scale):
@@ -113,25 +220,16 @@ class FrameProcessor:
 
     def _drawMarker(self, img, point, T):
         draw_col, outline_col = (255,255,255), (0,0,0)
-        d1, d2 = 3 * self.font_scale, 6 * self.font_scale
-        dsize = 1
+        d1 = 3 * self.font_scale
         (x, y) = point
-        for (color, width) in [(outline_col, 3 * dsize * self.font_scale - 1), (draw_col, dsize * self.font_scale)]:
-            cv2.line(img, (x+d1, y), (x+d2,y), color, width)
-            cv2.line(img, (x-d1, y), (x-d2,y), color, width)
-            cv2.line(img, (x, y+d1), (x,y+d2), color, width)
-            cv2.line(img, (x, y-d1), (x,y-d2), color, width)
-
-        t = '%.1fC' % T
-        text_size = cv2.getTextSize(t, self.font, 1, dsize)[0]
+        self._blit(img, self._crossSprite(), point)
+
+        sprite = self._textSprite('%.1fC' % T, draw_col, outline_col)
+        text_size = sprite[2]
         tx, ty = x+d1, y+d1+text_size[1]
         if tx + text_size[0] > img.shape[1]: tx = x-d1-text_size[0]
         if ty                > img.shape[0]: ty = y-d1
-
-        for offset in (-self.font_scale, self.font_scale):
-            cv2.putText(img, t, (tx + offset, ty), self.font, 1, outline_col, dsize, cv2.LINE_8)
-            cv2.putText(img, t, (tx, ty + offset), self.font, 1, outline_col, dsize, cv2.LINE_8)
-        cv2.putText(img, t, (tx,ty), self.font, 1, draw_col, dsize, cv2.LINE_8)
+        self._blit(img, sprite, (tx, ty))
 
 
     def addMarkers(self, frame, info):
@@ -140,30 +238,40 @@ class FrameProcessor:
         self._drawMarker(frame, self._scalePoint(info['Tcenter_point'], self.scale), info['Tcenter_C'])
         return frame
 
-def dumpLUT(lut):
-    with open("lut_dump.csv", "w") as f:
-        for v in lut:
-            print(v, file=f)
+    def addTracks(self, frame, tracks):
+        for track in tracks:
+            point = (round(float(track['x']) * self.scale), round(float(track['y']) * self.scale))
+            self._drawMarker(frame, point, track['T'])
+        return frame
 
-def main():
-    parser = ArgumentParser()
-    parser.add_argument("-d", "--device",
-        dest="device", default=None,
-        help="video device to use (default: auto)"
-    )
+    def render(self, frame, info, lut, legend = True, markers = True, tracks = None, settling = False, exposure = None):
+        # colorize directly into the output image, next to the cached legend
+        out = np.empty((self.height, self.getWidth(legend), 3), dtype=np.uint8)
+        if markers and self.region is not None:
+            info = dict(info, **self.region.stats(frame, lut))
+        frame = self.processImage(frame, info, lut, out[:, :self.width], settling, exposure)
+        if tracks is not None:
+            frame = self.addTracks(frame, tracks)
+        if markers:
+            frame = self.addMarkers(frame, info)
+        if legend:
+            out[:, self.width:] = self._legendImage()
+        return out
+
+def colormapName(name):
+    colormaps.palette(name.lower())
+    return name.lower()
+
+def addDisplayArguments(parser):
     parser.add_argument("-c", "--colormap",
         dest="colormap", default="inferno",
-        type=lambda s:getattr(cv2, "COLORMAP_" + s.upper()),
-        help="cv2 color map used for thermal gradient (default: inferno)"
+        type=colormapName,
+        help="color map used for thermal gradient: " + ", ".join(colormaps.COLORMAPS) + " or any other cv2 color map (default: inferno)"
     )
     parser.add_argument("-s", "--scale",
         dest="scale", default=2, choices=[1, 2, 3], type=int,
         help="scaling factor for video size (default: 2)"
     )
-    parser.add_argument("-m", "--sensor-mode",
-        dest="sensor",  choices=['low','high'], default="low",
-        help="set sensor mode to low (120°C) or high (400°C) temperature (default: low)"
-    )
     parser.add_argument("-r", "--range",
         dest="range",  type=int, nargs=2, metavar=('FROM', 'TO'),
         help="specify visualized temperature range (default: auto)"
@@ -176,6 +284,84 @@ def main():
         action="store_false", dest="markers", default=True,
         help="hide min/max/center temperature markers"
     )
+    parser.add_argument("--crop",
+        dest="crop", type=int, nargs=4, metavar=('X', 'Y', 'W', 'H'),
+        help="only process and show this region of the sensor (default: full frame)"
+    )
+    parser.add_argument("--decimate",
+        dest="decimate", default=1, type=int, metavar='N',
+        help="only process and show every N-th pixel in x and y (default: 1)"
+    )
+    parser.add_argument("-i", "--isotherm",
+        dest="isotherm", type=float, nargs=2, metavar=('FROM', 'TO'),
+        help="highlight temperatures in this range (default: off)"
+    )
+
+def parameterType(name):
+    # argparse type for a value of ht301_hacklib.PARAMETERS
+    def parse(value):
+        try:
+            return ht301_hacklib.checkParameter(name, float(value))
+        except ValueError as e:
+            raise ArgumentTypeError(str(e))
+    return parse
+
+def addParameterArguments(parser):
+    parser.add_argument("--emissivity",
+        dest="Emiss", type=parameterType("Emiss"), metavar='E',
+        help="emissivity of the object (default: from device)"
+    )
+    parser.add_argument("--reflected-temp",
+        dest="refltmp", type=parameterType("refltmp"), metavar='T',
+        help="reflected temperature in °C (default: from device)"
+    )
+    parser.add_argument("--air-temp",
+        dest="airtmp", type=parameterType("airtmp"), metavar='T',
+        help="air temperature in °C (default: from device)"
+    )
+    parser.add_argument("--humidity",
+        dest="Humi", type=parameterType("Humi"), metavar='H',
+        help="relative humidity 0..1 (default: from device)"
+    )
+    parser.add_argument("--distance",
+        dest="Distance", type=parameterType("Distance"), metavar='D',
+        help="distance to the object in m (default: from device)"
+    )
+
+def getRegion(args):
+    if args.crop is None and args.decimate == 1:
+        return None
+    roi = ((args.crop[0], args.crop[1]), (args.crop[2], args.crop[3])) if args.crop else None
+    return Region(roi, args.decimate)
+
+def getParameters(args):
+    return dict((k, getattr(args, k)) for k in ht301_hacklib.PARAMETERS if getattr(args, k, None) is not None)
+
+def dumpLUT(lut):
+    with open("lut_dump.csv", "w") as f:
+        for v in lut:
+            print(v, file=f)
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("-d", "--device",
+        dest="device", default=None,
+        help="video device to use (default: auto)"
+    )
+    parser.add_argument("-m", "--sensor-mode",
+        dest="sensor",  choices=['low','high'], default="low",
+        help="set sensor mode to low (120°C) or high (400°C) temperature (default: low)"
+    )
+    addDisplayArguments(parser)
+    addParameterArguments(parser)
+    parser.add_argument("-t", "--track",
+        dest="track", type=float, metavar='T',
+        help="track and mark hot spots above temperature T (default: off)"
+    )
+    parser.add_argument("-a", "--auto-calibrate",
+        dest="auto_calibrate", type=float, metavar='DT',
+        help="calibrate when the sensor temperature drifted more than DT °C (default: off)"
+    )
 
     parser.add_argument("--debug-dump-lut",
         action="store_true", dest="debug_dump_lut", default=False,
@@ -183,41 +369,65 @@ def main():
     )
     args = parser.parse_args()
 
-    with ht301_hacklib.HT301(args.device) as cap:
-        cap.useHighTempRange(args.sensor == "high")
+    # the scheduler runs the first calibration after setting the sensor mode
+    with ht301_hacklib.HT301(args.device, calibrate=False) as cap:
+        cap.setParameters(**getParameters(args))
+        scheduler = SensorScheduler(cap, drift=args.auto_calibrate)
+        scheduler.setHighTempRange(args.sensor == "high")
 
-        processor = FrameProcessor(cap.FRAME_WIDTH, cap.FRAME_HEIGHT, args.scale, args.colormap, args.range)
+        region = getRegion(args)
+        processor = FrameProcessor(cap.FRAME_WIDTH, cap.FRAME_HEIGHT, args.scale, args.colormap, args.range, region, args.isotherm)
+        tracker = HotspotTracker(args.track) if args.track is not None else None
+        tracks = None
         try:
             window_name = 'HT301'
             frame_counter = 0
+            recorder = None
             cv2.namedWindow(window_name, cv2.WINDOW_KEEPRATIO)
             cv2.resizeWindow(window_name, processor.getWidth(args.legend), processor.getHeight())
 
+            image = None
             while(True):
-                _, frame = cap.read()
-                info, lut = cap.info()
-                frame_counter += 1
+                # without a valid frame the keys are still handled
+                thermal_frame = cap.readFrame(scheduler)
+                if thermal_frame is not None:
+                    frame = thermal_frame.frame
+                    info, lut = thermal_frame.info()
+                    frame_counter += 1
+                    settling = thermal_frame.settling
+
+                    if recorder:
+                        recorder.write(thermal_frame, thermal_frame.high_range, settling)
 
-                frame = processor.processImage(frame, info)
-                if args.markers:
-                    frame = processor.addMarkers(frame, info)
-                if args.legend:
-                    frame = processor.addLegend(frame, info)
+                    if tracker and not settling:
+                        # tracks are in coordinates of the region, like the processed image
+                        tracks = tracker.update(region.view(frame) if region else frame, lut)
+                    image = processor.render(frame, info, lut, args.legend, args.markers, tracks, settling)
 
-                cv2.imshow(window_name, frame)
+                    cv2.imshow(window_name, image)
 
-                if args.debug_dump_lut and frame_counter == 20:
-                    dumpLUT(lut)
+                    if args.debug_dump_lut and frame_counter == 20:
+                        dumpLUT(lut)
 
                 key = cv2.waitKey(1) & 0xFF
                 if key == ord('q'):
                     break
                 if key == ord('u'):
-                    cap.calibrate()
-                if key == ord('s'):
-                    cv2.imwrite(time.strftime("%Y-%m-%d_%H:%M:%S") + '.png', frame)
+                    scheduler.calibrate()
+                if key == ord('s') and image is not None:
+                    cv2.imwrite(time.strftime("%Y-%m-%d_%H:%M:%S") + '.png', image)
+                if key == ord('r'):
+                    if recorder:
+                        recorder.close()
+                        print('recorded', recorder.count, 'frames to:', recorder.filename)
+                        recorder = None
+                    else:
+                        recorder = Recorder(time.strftime("%Y-%m-%d_%H:%M:%S") + '.raw')
+                        print('recording to:', recorder.filename)
 
         finally:
+            if recorder:
+                recorder.close()
             cv2.destroyAllWindows()
 
 
@@ -1,46 +1,37 @@
 #!/usr/bin/python3
 import numpy as np
-import cv2
-import matplotlib
-import matplotlib.pyplot as plt
-import matplotlib.animation as animation
-import matplotlib.patches as patches
-from matplotlib.backend_bases import MouseButton
-from mpl_toolkits.axes_grid1 import make_axes_locatable
 import ht301_hacklib
 import utils
+from autoexposure import AutoExposure
+from baseline import Baseline
+from scheduler import SensorScheduler
+import colormaps
+from argparse import ArgumentParser
 import time
-import sys
+
+# matplotlib is imported in main(), after the arguments are parsed
+plt = animation = MouseButton = ListedColormap = None
 
 fps = 40
 exposure = {'auto': True,
-            'auto_type': 'ends',  # 'center' or 'ends'
+            'auto_type': 'histogram',  # 'histogram', 'center' or 'ends'
             'T_min': 0.,
             'T_max': 50.,
             'T_margin': 2.0,
 }
 draw_temp = True
+auto_exposure = AutoExposure()
 
-#see https://matplotlib.org/tutorials/colors/colormaps.html
-cmaps_idx = 1
-cmaps = ['inferno', 'coolwarm', 'cividis', 'jet', 'nipy_spectral', 'binary', 'gray', 'tab10']
-
-matplotlib.rcParams['toolbar'] = 'None'
+# same color maps as opencv.py, frames are colorized with the cached colormaps tables
+cmaps_idx = 0
+cmaps = colormaps.COLORMAPS
 
 # temporary fake frame
-lut_frame = frame = np.full((ht301_hacklib.HT301.FRAME_HEIGHT, ht301_hacklib.HT301.FRAME_WIDTH), 25.)
+frame = np.full((ht301_hacklib.HT301.FRAME_HEIGHT, ht301_hacklib.HT301.FRAME_WIDTH), 25.)
 info = {}
 lut = None # will be defined later
 
-fig = plt.figure()
-fig.canvas.set_window_title('HT301')
-ax = plt.gca()
-im = ax.imshow(lut_frame, cmap=cmaps[cmaps_idx])
-divider = make_axes_locatable(ax)
-cax = divider.append_axes("right", size="5%", pad=0.05)
-cbar = plt.colorbar(im, cax=cax)
-
-annotations = utils.Annotations(ax, patches)
+fig = ax = im = cbar = annotations = cap = scheduler = None
 temp_annotations =  {
     'std': {
         'Tmin': 'lightblue',
@@ -58,37 +49,40 @@ paused = False
 update_colormap = True
 diff = { 'enabled': False,
          'annotation_enabled': False,
-         'frame': np.zeros(frame.shape)
+         'frame': None  # reference frame in C
 }
-
-if sys.argv[-1].endswith('.npy'):
-    cap = utils.HT301emulator(sys.argv[-1])
-    cap.restore_additional_values(globals())
-    annotations.set_roi(roi)
-    im.set_cmap(cmaps[cmaps_idx])
-else:
-    cap = ht301_hacklib.HT301()
+baseline = Baseline()
 
 
 def animate_func(i):
-    global lut, frame, info, paused, update_colormap, exposure, im, diff, lut_frame
+    global lut, frame, info, paused, update_colormap, exposure, im, diff
     ret, frame = cap.read()
+    settling = scheduler.update(cap.meta) if scheduler else False
     if not paused:
         info, lut = cap.info()
-        lut_frame = lut[frame]
-
-        if diff['enabled']: show_frame = lut_frame - diff['frame']
-        else:               show_frame = lut_frame
-        if diff['annotation_enabled']:
-                        annotation_frame = lut_frame - diff['frame']
-        else:           annotation_frame = lut_frame
 
-        im.set_array(show_frame)
-
-        annotations.update(temp_annotations, annotation_frame, draw_temp)
-
-        if exposure['auto']:
-            update_colormap = utils.autoExposure(update_colormap, exposure, show_frame)
+        # the frame is colorized from raw values, temperatures of the whole
+        # frame are only computed for the diff
+        diff_frame = baseline.diff(frame, lut) if diff['enabled'] or diff['annotation_enabled'] else None
+        if diff['enabled'] and diff_frame is not None:
+            im.set_array(diff_frame)
+        else:
+            raw_min, raw_max = auto_exposure.rawRange(exposure, lut)
+            im.set_array(colormaps.colorize(frame, colormaps.colorTable(cmaps[cmaps_idx], raw_min, raw_max, rgb=True)))
+
+        if diff['annotation_enabled'] and diff_frame is not None:
+            annotations.update(temp_annotations, diff_frame, draw_temp)
+        else:
+            annotations.update(temp_annotations, frame, draw_temp, lut)
+
+        if exposure['auto'] and not settling:
+            if exposure['auto_type'] == 'histogram' and not diff['enabled']:
+                update_colormap = auto_exposure.update(update_colormap, exposure, frame, lut)
+            elif diff['enabled'] and diff_frame is not None:
+                update_colormap = utils.autoExposure(update_colormap, exposure, diff_frame)
+            else:
+                # only min / max are used, the LUT is monotonic
+                update_colormap = utils.autoExposure(update_colormap, exposure, lut[[frame.min(), frame.max()]])
 
         if update_colormap:
             im.set_clim(exposure['T_min'], exposure['T_max'])
@@ -123,20 +117,20 @@ mouse:
 #keyboard
 def press(event):
     global paused, exposure, update_colormap, cmaps_idx, draw_temp, temp_extra_annotations
-    global lut_frame, lut, frame, diff, annotations, roi
+    global lut, frame, diff, annotations, roi
     if event.key == 'h': print_help()
     if event.key == ' ': paused ^= True; print('paused:', paused)
-    if event.key == 'd': diff['frame'] = lut_frame; diff['annotation_enabled'] = diff['enabled'] = True; print('set   diff')
+    if event.key == 'd': baseline.set(frame, lut); diff['frame'] = baseline.reference(); diff['annotation_enabled'] = diff['enabled'] = True; print('set   diff')
     if event.key == 'x': diff['enabled'] ^= True; print('enable diff:', diff['enabled'])
     if event.key == 'c': diff['annotation_enabled'] ^= True; print('enable annotation diff:', diff['annotation_enabled'])
     if event.key == 't': draw_temp ^= True; print('draw temp:', draw_temp)
     if event.key == 'e':
         print('removing user annotations: ', len(temp_annotations['user']))
         annotations.remove(temp_annotations['user'])
-    if event.key == 'u': print('calibrate'); cap.calibrate()
-    if event.key == 'a': exposure['auto'] ^= True; print('auto exposure:', exposure['auto'], ', type:', exposure['auto_type'])
+    if event.key == 'u' and scheduler: print('calibrate'); scheduler.calibrate()
+    if event.key == 'a': exposure['auto'] ^= True; auto_exposure.reset(); print('auto exposure:', exposure['auto'], ', type:', exposure['auto_type'])
     if event.key == 'z':
-        types = ['center', 'ends']
+        types = ['histogram', 'center', 'ends']
         exposure['auto_type'] = types[types.index(exposure['auto_type'])-1]
         print('auto exposure:', exposure['auto'], ', type:', exposure['auto_type'])
     if event.key == 'w':
@@ -151,7 +145,7 @@ def press(event):
         if event.key == '.': cmaps_idx= (cmaps_idx + 1) % len(cmaps)
         else:                cmaps_idx= (cmaps_idx - 1) % len(cmaps)
         print('color map:', cmaps[cmaps_idx])
-        im.set_cmap(cmaps[cmaps_idx])
+        im.set_cmap(cmap(cmaps[cmaps_idx]))
         update_colormap = True
     if event.key in ['left', 'right', 'up', 'down']:
         exposure['auto'] = False
@@ -198,11 +192,62 @@ def onmotion(event):
             annotations.set_roi(roi)
 
 
-anim = animation.FuncAnimation(fig, animate_func, interval = 1000 / fps, blit=True)
-fig.canvas.mpl_connect('button_press_event', onclick)
-fig.canvas.mpl_connect('motion_notify_event', onmotion)
-fig.canvas.mpl_connect('key_press_event', press)
-
-print_help()
-plt.show()
-cap.release()
+def cmap(name):
+    # matplotlib colormap for the colorbar and the diff view
+    return ListedColormap(colormaps.palette(name) / 255., name=name)
+
+def main():
+    global plt, animation, MouseButton, ListedColormap
+    global fig, ax, im, cbar, annotations, cap, scheduler, cmaps_idx
+
+    parser = ArgumentParser()
+    parser.add_argument("recording", nargs='?', default=None,
+        help="raw data file saved with 'r' (date.npy) to show instead of the camera"
+    )
+    args = parser.parse_args()
+
+    import matplotlib
+    import matplotlib.pyplot as plt
+    import matplotlib.animation as animation
+    import matplotlib.patches as patches
+    from matplotlib.backend_bases import MouseButton
+    from matplotlib.colors import ListedColormap
+    from mpl_toolkits.axes_grid1 import make_axes_locatable
+
+    matplotlib.rcParams['toolbar'] = 'None'
+
+    fig = plt.figure()
+    fig.canvas.set_window_title('HT301')
+    ax = plt.gca()
+    im = ax.imshow(frame, cmap=cmap(cmaps[cmaps_idx]))
+    divider = make_axes_locatable(ax)
+    cax = divider.append_axes("right", size="5%", pad=0.05)
+    cbar = plt.colorbar(im, cax=cax)
+
+    annotations = utils.Annotations(ax, patches)
+
+    if args.recording:
+        cap = utils.HT301emulator(args.recording)
+        cap.restore_additional_values(globals())
+        if diff.get('frame') is not None:
+            baseline.set(diff['frame'])
+        annotations.set_roi(roi)
+        cmaps_idx %= len(cmaps)
+        im.set_cmap(cmap(cmaps[cmaps_idx]))
+    else:
+        cap = ht301_hacklib.HT301(calibrate=False)
+        scheduler = SensorScheduler(cap)
+        scheduler.calibrate()
+
+    anim = animation.FuncAnimation(fig, animate_func, interval = 1000 / fps, blit=True)
+    fig.canvas.mpl_connect('button_press_event', onclick)
+    fig.canvas.mpl_connect('motion_notify_event', onmotion)
+    fig.canvas.mpl_connect('key_press_event', press)
+
+    print_help()
+    plt.show()
+    cap.release()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+import os
+import numpy as np
+import ht301_hacklib
+
+# A recording is the plain concatenation of raw frames as read from the
+# device (visible frame followed by the 4 meta rows, little endian uint16),
+# so it can be appended to while capturing and memory mapped for reading.
+# The sidecar file <recording>.flags holds one byte of FLAG_* bits per frame
+# for the sensor state the meta rows do not tell.
+FRAME_RAW_SHAPE = (ht301_hacklib.HT301.FRAME_RAW_HEIGHT, ht301_hacklib.HT301.FRAME_RAW_WIDTH)
+
+FLAG_HIGH_RANGE = 1
+FLAG_SETTLING = 2
+
+def flagsFilename(filename):
+    return filename + '.flags'
+
+class Recorder:
+    def __init__(self, filename):
+        self.filename = filename
+        self.file = open(filename, 'ab')
+        self.flags = open(flagsFilename(filename), 'ab')
+        self.count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def write(self, frame_raw, high_range = False, settling = False):
+        # written straight from the frame buffer (ThermalFrame or array), no copy for little endian uint16
+        self.file.write(np.ascontiguousarray(frame_raw, dtype='<u2'))
+        self.flags.write(bytes(((FLAG_HIGH_RANGE if high_range else 0) | (FLAG_SETTLING if settling else 0),)))
+        self.count += 1
+
+    def close(self):
+        self.file.close()
+        self.flags.close()
+
+
+def load(filename):
+    # an empty or just started recording has no complete frame yet
+    if os.path.getsize(filename) < FRAME_RAW_SHAPE[0] * FRAME_RAW_SHAPE[1] * 2:
+        return np.zeros((0,) + FRAME_RAW_SHAPE, dtype='<u2')
+    data = np.memmap(filename, dtype='<u2', mode='r')
+    return data[:data.size - data.size % (FRAME_RAW_SHAPE[0] * FRAME_RAW_SHAPE[1])].reshape((-1,) + FRAME_RAW_SHAPE)
+
+def loadFlags(filename, count):
+    # FLAG_* bits of count frames, None for recordings without flags file,
+    # frames missing in the flags file get 0
+    if not os.path.exists(flagsFilename(filename)):
+        return None
+    flags = np.zeros(count, dtype=np.uint8)
+    data = np.fromfile(flagsFilename(filename), dtype=np.uint8, count=count)
+    flags[:len(data)] = data
+    return flags
+
+def frameInfo(frame_raw, high_range = False, parameters = None):
+    # split a recorded raw frame and compute its info and LUT like HT301.read()/info()
+    frame, meta = frame_raw[:-4], frame_raw[-4:]
+    device_strings = ht301_hacklib.device_info(meta)
+    info, lut = ht301_hacklib.info(meta, device_strings, frame.shape[1], frame.shape[0], high_range, parameters)
+    return frame, info, lut
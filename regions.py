@@ -0,0 +1,62 @@
+import numpy as np
+import ht301_hacklib
+import utils
+
+def frameStats(frame, lut):
+    # min / max / center temperature of a (cropped, decimated) raw frame,
+    # keys as in the info dict, points in coordinates of the given frame.
+    # The LUT is monotonic, so min / max are searched in raw values.
+    height, width = frame.shape
+    imin, imax = int(np.argmin(frame)), int(np.argmax(frame))
+    Tmin_raw, Tmax_raw = int(frame.flat[imin]), int(frame.flat[imax])
+    center = (width // 2, height // 2)
+    Tcenter_raw = int(frame[center[1], center[0]])
+    return {
+        'Tmin_C': lut[Tmin_raw],
+        'Tmin_raw': Tmin_raw,
+        'Tmin_point': (imin % width, imin // width),
+        'Tmax_C': lut[Tmax_raw],
+        'Tmax_raw': Tmax_raw,
+        'Tmax_point': (imax % width, imax // width),
+        'Tcenter_C': lut[Tcenter_raw],
+        'Tcenter_raw': Tcenter_raw,
+        'Tcenter_point': center,
+    }
+
+
+class Region:
+    # Crop ((x,y),(w,h)) and / or decimation step declared up front: every
+    # stage then works on the strided view of the frame, so the per frame
+    # cost scales with the region and not with the sensor size.
+    def __init__(self, roi = None, step = 1, shape = (ht301_hacklib.HT301.FRAME_HEIGHT, ht301_hacklib.HT301.FRAME_WIDTH)):
+        if roi is None:
+            roi = ((0, 0), (shape[1], shape[0]))
+        ((x1,y1),(x2,y2)) = utils.correctRoi(roi, shape)
+        x2, y2 = min(x2, shape[1]), min(y2, shape[0])
+        if x1 >= x2 or y1 >= y2:
+            raise ValueError('empty region: ' + str(roi))
+        if step < 1:
+            raise ValueError('invalid decimation step: ' + str(step))
+        self.roi = ((x1,y1),(x2,y2))
+        self.step = step
+        self.slices = (slice(y1, y2, step), slice(x1, x2, step))
+        self.shape = (len(range(y1, y2, step)), len(range(x1, x2, step)))
+
+    def view(self, frame):
+        return frame[self.slices]
+
+    def toRegion(self, point):
+        # sensor coordinates -> coordinates in the view
+        ((x1,y1),_) = self.roi
+        return ((point[0] - x1) / self.step, (point[1] - y1) / self.step)
+
+    def toFrame(self, point):
+        # coordinates in the view -> sensor coordinates
+        ((x1,y1),_) = self.roi
+        return (x1 + point[0] * self.step, y1 + point[1] * self.step)
+
+    def temperatures(self, frame, lut):
+        return lut[self.view(frame)]
+
+    def stats(self, frame, lut):
+        return frameStats(self.view(frame), lut)
@@ -0,0 +1,75 @@
+import time
+from collections import deque
+import ht301_hacklib
+
+class SensorScheduler:
+    # Runs sensor mode switches and flat field calibrations between frames
+    # instead of sleeping on the caller: commands are queued and executed by
+    # update(), which is called once for every frame read (cap.readFrame(scheduler)
+    # does it and tags the ThermalFrame). Frames captured
+    # while the shutter is closed or the sensor settles after a mode switch
+    # are reported as settling, so filters and statistics can skip them.
+    # With drift set, a calibration is queued whenever the FPA temperature
+    # moved more than drift C since the last one (at most every min_interval s).
+    def __init__(self, cap, settle_seconds = 0.5, shutter_seconds = 0.3, drift = None, min_interval = 30., clock = time.monotonic):
+        self.cap = cap
+        self.settle_seconds = settle_seconds
+        self.shutter_seconds = shutter_seconds
+        self.drift = drift
+        self.min_interval = min_interval
+        self.clock = clock
+        self.queue = deque()
+        self.busy_until = None
+        self.calibrating = False
+        self.calibrated_at = None
+        self.fpa_reference = None
+
+    def calibrate(self):
+        if 'calibrate' not in self.queue:
+            self.queue.append('calibrate')
+
+    def setHighTempRange(self, enable):
+        # the mode switch is followed by a calibration once the sensor settled
+        self.queue.append('high' if enable else 'low')
+        self.calibrate()
+
+    def pending(self):
+        return len(self.queue) > 0
+
+    def settling(self):
+        return self.busy_until is not None and self.clock() < self.busy_until
+
+    def update(self, meta = None):
+        # call once per frame read, returns True if that frame has to be skipped
+        now = self.clock()
+        if self.busy_until is not None:
+            if now < self.busy_until:
+                return True
+            self.busy_until = None
+            if self.calibrating:
+                # first frame after a calibration is the new drift reference
+                self.calibrating = False
+                self.calibrated_at = now
+                self.fpa_reference = None
+
+        if meta is not None and self.drift is not None:
+            fpa = ht301_hacklib.fpaTemperature(meta[0])
+            if self.fpa_reference is None:
+                self.fpa_reference = fpa
+            elif (abs(fpa - self.fpa_reference) > self.drift and not self.queue and
+                  (self.calibrated_at is None or now - self.calibrated_at >= self.min_interval)):
+                self.calibrate()
+
+        if not self.queue:
+            return False
+
+        command = self.queue.popleft()
+        if command == 'calibrate':
+            self.cap.calibrate()
+            self.calibrating = True
+            self.busy_until = now + self.shutter_seconds
+        else:
+            self.cap.setHighTempRange(command == 'high')
+            self.busy_until = now + self.settle_seconds
+        # this frame was captured before the command was sent
+        return False
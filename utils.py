@@ -1,5 +1,4 @@
 import numpy as np
-import cv2
 
 def autoExposure(update, exposure, frame):
     # Sketchy auto-exposure
@@ -96,11 +95,13 @@ class Annotations:
             self.anns[name] = self.ax.annotate(**self.astyle, bbox=dict(boxstyle='square', fc=color, alpha=0.3, lw=0))
         return self.anns[name]
 
-    def update(self, temp_annotations, annotation_frame, draw_temp):
+    def update(self, temp_annotations, annotation_frame, draw_temp, lut = None):
+        # with lut, annotation_frame is a raw frame and only the annotated
+        # points are converted, min / max positions are the same in raw values
         l = temp_annotations['std'].items() | temp_annotations['user'].items()
         for name, color in l:
             pos = self.get_pos(name, annotation_frame, self.roi)
-            self.ann_set_temp(self.get_ann(name, color), pos, annotation_frame, draw_temp)
+            self.ann_set_temp(self.get_ann(name, color), pos, annotation_frame, draw_temp, lut)
 
     def get(self):
         return list(self.anns.values()) + [self.roi_patch]
@@ -112,10 +113,11 @@ class Annotations:
                 del self.anns[name]
         d.clear()
 
-    def ann_set_temp(self, ann, pos, annotation_frame, draw_temp):
+    def ann_set_temp(self, ann, pos, annotation_frame, draw_temp, lut = None):
         (x,y) = pos
         ann.xy  = pos
         value = annotation_frame[pos[1], pos[0]]
+        if lut is not None: value = lut[value]
         ann.set_text('%.2f$^\circ$C' % value)
         ann.set_visible(draw_temp)
         tx,ty = 20, 15